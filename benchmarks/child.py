@@ -0,0 +1,24 @@
+import atexit
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+if os.environ.get('BENCH_FINTS_TRANSACTIONS'):
+    import fints.client
+    from fakes import ScriptedFinTSClient
+
+    ScriptedFinTSClient.count = int(os.environ['BENCH_FINTS_TRANSACTIONS'])
+    fints.client.FinTS3PinTanClient = ScriptedFinTSClient
+
+    import pretix_banktool.fints
+    pretix_banktool.fints.FinTS3PinTanClient = ScriptedFinTSClient
+
+    if os.environ.get('BENCH_STATS'):
+        atexit.register(lambda: json.dump(dict(ScriptedFinTSClient.requests), open(os.environ['BENCH_STATS'], 'w')))
+
+from pretix_banktool.main import main
+
+main()
@@ -0,0 +1,244 @@
+import json
+import random
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+
+def synthetic_transactions(count, seed=0):
+    rnd = random.Random(seed)
+    today = date.today()
+    for i in range(count):
+        yield {
+            'amount': Decimal(rnd.randint(100, 50000)) / 100,
+            'date': today - timedelta(days=i * 30 // max(count, 1)),
+            'name': 'Payer %d' % rnd.randint(1, 5000),
+            'iban': 'DE%020d' % rnd.randint(0, 10 ** 20 - 1),
+            'reference': 'Order %s-%05d' % ('ABCDE'[i % 5], i),
+            'bank_reference': 'B%010d' % i,
+        }
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.requests = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests.clear()
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    routes = ()
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        body = b''
+        if self.headers.get('Content-Length'):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.bytes_in += len(body)
+        for m, prefix, name in self.routes:
+            if m == method and url.path.startswith(prefix):
+                with self.server.lock:
+                    self.server.requests[name] += 1
+                status, data = getattr(self, name)(url.path, parse_qs(url.query), body)
+                break
+        else:
+            status, data = 404, {'detail': 'Not found'}
+        out = json.dumps(data).encode()
+        with self.server.lock:
+            self.server.bytes_out += len(out)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+class PretixHandler(Handler):
+    routes = (
+        ('POST', '/api/v1/organizers/bench/bankimportjobs/', 'create_job'),
+        ('GET', '/api/v1/organizers/bench/bankimportjobs/', 'get_jobs'),
+    )
+
+    def create_job(self, path, query, body):
+        data = json.loads(body)
+        with self.server.lock:
+            job = {
+                'id': len(self.server.jobs) + 1,
+                'event': data.get('event'),
+                'state': 'completed',
+                'transactions': [
+                    dict(t, state=('valid', 'already', 'nomatch')[i % 3], checksum=str(i))
+                    for i, t in enumerate(data['transactions'])
+                ],
+            }
+            self.server.jobs.append(job)
+            self.server.uploaded += len(job['transactions'])
+        return 201, job
+
+    def get_jobs(self, path, query, body):
+        job_id = path.rstrip('/').rsplit('/', 1)[-1]
+        if job_id.isdigit():
+            jobs = [j for j in self.server.jobs if j['id'] == int(job_id)]
+            return (200, jobs[0]) if jobs else (404, {'detail': 'Not found'})
+
+        jobs = self.server.jobs
+        if query.get('ordering', [''])[0] == '-created':
+            jobs = list(reversed(jobs))
+        page_size = min(int(query.get('page_size', ['50'])[0]), 50)
+        page = int(query.get('page', ['1'])[0])
+        start = (page - 1) * page_size
+        return 200, {
+            'count': len(jobs),
+            'next': 'page=%d' % (page + 1) if start + page_size < len(jobs) else None,
+            'previous': None,
+            'results': jobs[start:start + page_size],
+        }
+
+
+class PretixServer(FakeServer):
+    def __init__(self, jobs=0, transactions_per_job=10):
+        super().__init__(PretixHandler)
+        # Number of transactions received in new jobs since the last reset
+        self.uploaded = 0
+        self.jobs = []
+        for i in range(jobs):
+            self.jobs.append({
+                'id': i + 1,
+                'event': None,
+                'state': 'completed',
+                'transactions': [
+                    {
+                        'amount': str(t['amount']), 'date': t['date'].isoformat(), 'payer': t['name'],
+                        'reference': t['reference'], 'state': ('valid', 'already', 'nomatch')[j % 3],
+                    }
+                    for j, t in enumerate(synthetic_transactions(transactions_per_job, seed=i))
+                ],
+            })
+
+    def reset_stats(self):
+        super().reset_stats()
+        with self.lock:
+            self.uploaded = 0
+
+
+class EnableBankingHandler(Handler):
+    routes = (
+        ('GET', '/application', 'application'),
+        ('GET', '/sessions/', 'session'),
+        ('GET', '/accounts/', 'transactions'),
+    )
+
+    def application(self, path, query, body):
+        return 200, {'name': 'bench', 'redirect_urls': ['https://localhost/']}
+
+    def session(self, path, query, body):
+        return 200, {'accounts': ['acc-%d' % i for i in range(self.server.accounts)], 'status': 'AUTHORIZED'}
+
+    def transactions(self, path, query, body):
+        offset = int(query.get('continuation_key', ['0'])[0])
+        size = self.server.page_size
+        rows = []
+        for i, t in enumerate(synthetic_transactions(min(size, self.server.count - offset), seed=offset)):
+            rows.append({
+                'transaction_amount': {'amount': str(t['amount']), 'currency': 'EUR'},
+                'remittance_information': [t['reference']],
+                'debtor': {'name': t['name']},
+                'debtor_account': {'iban': t['iban']},
+                'booking_date': t['date'].isoformat(),
+                'entry_reference': t['bank_reference'],
+            })
+        nxt = offset + size
+        return 200, {'transactions': rows, 'continuation_key': str(nxt) if nxt < self.server.count else None}
+
+
+class EnableBankingServer(FakeServer):
+    def __init__(self, count, page_size=500, accounts=1):
+        super().__init__(EnableBankingHandler)
+        self.count = count
+        self.page_size = page_size
+        self.accounts = accounts
+
+
+class ScriptedFinTSClient:
+    # Stands in for FinTS3PinTanClient and answers like a bank that needs no TAN
+    count = 0
+    requests = Counter()
+
+    def __init__(self, *args, **kwargs):
+        self.init_tan_response = None
+        self.selected_tan_medium = None
+
+    def __enter__(self):
+        self.requests['dialog'] += 1
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get_current_tan_mechanism(self):
+        return '942'
+
+    def is_tan_media_required(self):
+        return False
+
+    def deconstruct(self, including_private=False):
+        return b'scripted'
+
+    def get_sepa_accounts(self):
+        from fints.models import SEPAAccount
+
+        self.requests['get_sepa_accounts'] += 1
+        return [SEPAAccount(iban='DE00000000000000000000', bic='BENCHXXX', accountnumber='1', subaccount='',
+                            blz='10000000')]
+
+    def get_transactions(self, account, start_date=None, end_date=None, include_pending=False):
+        self.requests['get_transactions'] += 1
+        return [
+            SimpleNamespace(data={
+                'amount': SimpleNamespace(amount=t['amount']),
+                'date': t['date'],
+                'applicant_name': t['name'],
+                'applicant_iban': t['iban'],
+                'purpose': t['reference'],
+                'bank_reference': t['bank_reference'],
+            })
+            for t in synthetic_transactions(self.count)
+        ]
@@ -0,0 +1,208 @@
+"""
+Offline benchmarks for pretix-banktool.
+
+Local stand-ins for the pretix bankimportjobs API and the Enable Banking API are started, and the FinTS client is
+replaced by a scripted one. Every phase runs the real command line tool in a separate process, so wall time and
+peak RSS are measured per phase. Run it with
+
+    python benchmarks/run.py --sizes 1000,10000,100000 --json results.json
+
+and compare the JSON output between releases.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import EnableBankingServer, PretixServer  # noqa
+
+CHILD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'child.py')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KEYFILE_SIZE = 3271
+
+# Modules that must not be loaded for --help and listuploads
+HEAVY_MODULES = ('fints', 'jwt', 'cryptography', 'mt940')
+IMPORT_CHECK = '''
+import json, sys, time
+start = time.perf_counter()
+import pretix_banktool.main, pretix_banktool.sync, pretix_banktool.pretix, pretix_banktool.jobcache
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'loaded': sorted({m.split('.')[0] for m in sys.modules} & set(%r)),
+}))
+''' % (HEAVY_MODULES,)
+
+
+def check_imports(budget):
+    out = subprocess.run([sys.executable, '-c', IMPORT_CHECK], cwd=ROOT,
+                         stdout=subprocess.PIPE, check=True).stdout
+    data = json.loads(out)
+    ok = not data['loaded'] and data['seconds'] <= budget
+    print('{:<28} {:>9} {:<6} {:>9.3f}s  budget {:.3f}s  heavy modules loaded: {}'.format(
+        'import-main', '', 'ok' if ok else 'FAIL', data['seconds'], budget, ', '.join(data['loaded']) or 'none'
+    ))
+    return {'phase': 'import-main', 'ok': ok, 'wall': data['seconds'], 'budget': budget, 'loaded': data['loaded']}
+
+
+def write_keyfile(path):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=4096)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption(),
+    )
+    # The config validation expects the exact size of the key files handed out by Enable Banking
+    with open(path, 'wb') as f:
+        f.write(pem + b'\n' * (KEYFILE_SIZE - len(pem)))
+
+
+def write_config(path, sections):
+    with open(path, 'w') as f:
+        for name, values in sections.items():
+            f.write('[%s]\n' % name)
+            for k, v in values.items():
+                f.write('%s = %s\n' % (k, v))
+            f.write('\n')
+    return path
+
+
+def run_phase(name, size, args, servers, env=None, expect_uploaded=None):
+    for s in servers:
+        s.reset_stats()
+    stats_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False).name
+    env = dict(os.environ, BENCH_STATS=stats_file, **(env or {}))
+
+    with tempfile.TemporaryFile() as output:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, CHILD] + args, env=env, stdin=subprocess.DEVNULL,
+                                stdout=output, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.perf_counter() - start
+        if proc.returncode != 0:
+            output.seek(0)
+            sys.stderr.write(output.read().decode(errors='replace'))
+
+    requests = {}
+    for s in servers:
+        requests.update(s.requests)
+    try:
+        with open(stats_file) as f:
+            requests.update({'fints.' + k: v for k, v in json.load(f).items()})
+    except (OSError, ValueError):
+        pass
+    os.unlink(stats_file)
+
+    # A run that exits cleanly but loses transactions on the way is a failure as well
+    uploaded = sum(getattr(s, 'uploaded', 0) for s in servers)
+    ok = proc.returncode == 0
+    if expect_uploaded is not None and uploaded != expect_uploaded:
+        sys.stderr.write('%s: %d transactions uploaded, expected %d\n' % (name, uploaded, expect_uploaded))
+        ok = False
+
+    return {
+        'phase': name,
+        'size': size,
+        'ok': ok,
+        'uploaded': uploaded,
+        'wall': wall,
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+        'requests': requests,
+        'bytes_sent': sum(s.bytes_in for s in servers),
+        'bytes_received': sum(s.bytes_out for s in servers),
+    }
+
+
+def print_result(r):
+    print('{phase:<28} {size:>9} {status:<6} {wall:>9.2f}s {peak_rss_mb:>8.1f} MB {nreq:>7} req {mb:>9.2f} MB'.format(
+        status='ok' if r['ok'] else 'FAIL', nreq=sum(r['requests'].values()),
+        mb=(r['bytes_sent'] + r['bytes_received']) / 1024 / 1024, **r
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for pretix-banktool')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Comma separated numbers of synthetic transactions, e.g. 1000,10000,1000000')
+    parser.add_argument('--jobs', type=int, default=1000, help='Number of import jobs on the fake pretix server')
+    parser.add_argument('--import-budget', type=float, default=0.5,
+                        help='Maximum number of seconds for importing the command line entry point')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    results = [check_imports(args.import_budget)]
+    with tempfile.TemporaryDirectory() as tmp:
+        keyfile = os.path.join(tmp, 'bench.pem')
+        write_keyfile(keyfile)
+
+        for size in [int(s) for s in args.sizes.split(',')]:
+            pretix = PretixServer().start()
+            eb = EnableBankingServer(size).start()
+            workdir = tempfile.mkdtemp(dir=tmp)
+            pretix_section = {'server': pretix.url, 'organizer': 'bench', 'key': 'bench'}
+
+            fints_cfg = write_config(os.path.join(workdir, 'fints.cfg'), {
+                'banktool': {'type': 'fints'},
+                'fints': {'blz': '10000000', 'iban': 'DE00000000000000000000', 'username': 'bench',
+                          'endpoint': 'https://localhost/fints', 'pin': 'bench'},
+                'pretix': pretix_section,
+            })
+            eb_cfg = write_config(os.path.join(workdir, 'enablebanking.cfg'), {
+                'banktool': {'type': 'enablebanking'},
+                'enablebanking': {'keyFile': keyfile, 'applicationId': str(uuid.uuid4()), 'aspspName': 'Bench',
+                                  'aspspCountry': 'DE', 'sessionId': str(uuid.uuid4()), 'api_origin': eb.url},
+                'pretix': pretix_section,
+            })
+
+            phases = [
+                ('fints-upload', ['upload', '--no-ledger', fints_cfg], {'BENCH_FINTS_TRANSACTIONS': str(size)}, size),
+                ('enablebanking-upload', ['upload', eb_cfg], {}, size),
+                # Everything is in the ledger already, nothing may be sent again
+                ('enablebanking-upload-known', ['upload', eb_cfg], {}, 0),
+            ]
+            for name, cmd, env, expect_uploaded in phases:
+                r = run_phase(name, size, cmd, [pretix, eb], env, expect_uploaded)
+                print_result(r)
+                results.append(r)
+
+            pretix.stop()
+            eb.stop()
+
+        pretix = PretixServer(jobs=args.jobs).start()
+        workdir = tempfile.mkdtemp(dir=tmp)
+        cfg = write_config(os.path.join(workdir, 'pretix.cfg'), {
+            'banktool': {'type': 'fints'},
+            'fints': {'blz': '10000000', 'iban': 'DE00000000000000000000', 'username': 'bench',
+                      'endpoint': 'https://localhost/fints', 'pin': 'bench'},
+            'pretix': {'server': pretix.url, 'organizer': 'bench', 'key': 'bench'},
+        })
+        for name, cmd in [
+            ('help', ['--help']),
+            ('listuploads', ['listuploads', '--last', '200', '--no-cache', cfg]),
+            ('listuploads-cache-cold', ['listuploads', '--last', '200', cfg]),
+            ('listuploads-cache-warm', ['listuploads', '--last', '200', cfg]),
+        ]:
+            r = run_phase(name, args.jobs, cmd, [pretix], expect_uploaded=0)
+            print_result(r)
+            results.append(r)
+        pretix.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if not all(r['ok'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
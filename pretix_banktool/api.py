@@ -0,0 +1,61 @@
+from .config import get_state_file, load_config, validate_config, validate_pretix_config
+from .exceptions import (
+    BanktoolError, BankError, ConfigError, InputError, InteractionRequired, PretixError, UploadError, WaitTimeout,
+)
+from .sync import clear_checkpoints, fetch_payload, get_backend, get_ignore_filter, upload_payload
+
+__all__ = [
+    'BanktoolError', 'BankError', 'ConfigError', 'InputError', 'InteractionRequired', 'PretixError', 'UploadError',
+    'WaitTimeout',
+    'fetch_transactions', 'get_backend', 'list_jobs', 'open_config', 'sync', 'upload_transactions',
+]
+
+# Entry points for using the banktool from other Python programs. Errors are raised as the exceptions above
+# instead of ending the process, so many syncs can run in one long-lived worker. Backends can be created once with
+# get_backend() and passed to every call to keep their HTTP connections and bank dialog state.
+
+
+def open_config(configfile, pretix_only=False):
+    config = load_config(configfile)
+    if pretix_only:
+        validate_pretix_config(config)
+    else:
+        validate_config(config)
+    return config
+
+
+def fetch_transactions(config, backend=None, days=30, pending=False, bank_ids=False, auto_window=False):
+    payload = fetch_payload(config, backend or get_backend(config), days, pending, bank_ids, auto_window)
+    if payload is None:
+        return iter(())
+    return iter(payload['transactions'])
+
+
+def upload_transactions(config, transactions, ledger=True, ignore=(), wait=None):
+    payload = {
+        'event': None,
+        'transactions': transactions,
+    }
+    return upload_payload(config, payload, ledger, get_ignore_filter(config, ignore), wait)
+
+
+def sync(config, backend=None, days=30, pending=False, bank_ids=False, auto_window=False, ledger=True, ignore=(),
+         wait=False, wait_timeout=300):
+    backend = backend or get_backend(config)
+    jobs = upload_transactions(
+        config, fetch_transactions(config, backend, days, pending, bank_ids, auto_window), ledger, ignore,
+        wait_timeout if wait else None
+    )
+    clear_checkpoints(config, backend)
+    return jobs
+
+
+def list_jobs(config, last=1, cache=True):
+    from .jobcache import JobCache
+    from .pretix import getJobs
+    from .routing import get_pretix_configs
+
+    jobs = []
+    for c in get_pretix_configs(config):
+        jobs += getJobs(c, last, JobCache(get_state_file(c, 'jobs.json')) if cache else None)
+    return jobs
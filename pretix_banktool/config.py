@@ -1,30 +1,51 @@
-import sys
+import configparser
+import glob
+import os
+import threading
 from urllib.parse import urljoin
 
 import click
 
+from .exceptions import ConfigError, InteractionRequired
+
+# Held while talking to the user, so prompts of concurrently running syncs do not interleave on the terminal
+prompt_lock = threading.RLock()
+
+
+def expand_configfiles(paths):
+    configfiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            configfiles += sorted(glob.glob(os.path.join(path, '*.cfg')))
+        else:
+            configfiles.append(path)
+    return configfiles
+
+
+def load_config(configfile):
+    config = configparser.ConfigParser()
+    config.read(configfile)
+    config.path = configfile
+    return config
+
 
 def validate_config(config, ignoreSessionIdMissing = False):
     validate_pretix_config(config)
     if 'banktool' not in config:
-        click.echo(click.style('Invalid config file: Does not contain banktool section', fg='red'))
-        sys.exit(1)
+        raise ConfigError('Invalid config file: Does not contain banktool section')
     if 'type' not in config['banktool']:
-        click.echo(click.style('Invalid config file: Does not contain connection type', fg='red'))
-        sys.exit(1)
+        raise ConfigError('Invalid config file: Does not contain connection type')
     if config['banktool']['type'] == 'fints':
         validate_fints_config(config)
     elif config['banktool']['type'] == 'enablebanking':
         validate_enablebanking_config(config, ignoreSessionIdMissing)
     else:
-        click.echo(click.style('Invalid config file: Unknown type %s' % config['banktool']['type'], fg='red'))
-        sys.exit(1)
+        raise ConfigError('Invalid config file: Unknown type %s' % config['banktool']['type'])
 
 
 def validate_enablebanking_config(config, ignoreSessionIdMissing):
     if 'enablebanking' not in config:
-        click.echo(click.style('Invalid config file: Does not contain enablebanking section', fg='red'))
-        sys.exit(1)
+        raise ConfigError('Invalid config file: Does not contain enablebanking section')
 
     for f in ("keyfile", "applicationid", "aspspname", "aspspcountry", "sessionid"):
         if f not in config['enablebanking']:
@@ -32,50 +53,49 @@ def validate_enablebanking_config(config, ignoreSessionIdMissing):
                 if ignoreSessionIdMissing:
                     continue
                 else:
-                    click.echo(click.style("Please run register command to get a sessionid", fg='red'))
-                    sys.exit(1)
+                    raise ConfigError("Please run register command to get a sessionid")
             else:
-                click.echo(click.style('Invalid config file: Does not contain value for enablebanking.%s' % f, fg='red'))
-                sys.exit(1)
+                raise ConfigError('Invalid config file: Does not contain value for enablebanking.%s' % f)
 
     lAppId = 36
     if len(config["enablebanking"]["applicationId"]) != lAppId:
-        click.echo(click.style('Invalid application id length, expected ' + str(lAppId) + ' characters', fg='red'))
-        sys.exit(1)
+        raise ConfigError('Invalid application id length, expected ' + str(lAppId) + ' characters')
 
     sKeyfile = 3271
     try:
         with open(config["enablebanking"]["keyfile"], "rb") as f:
             b = f.read()
-            
-        if len(b) != sKeyfile:
-            click.echo(click.style('Invalid key file size, expected ' + str(sKeyfile) + ' bytes', fg='red'))
-            sys.exit(1)
-    except:
-        click.echo(click.style('Unable to read keyfile', fg='red'))
-        sys.exit(1)
+    except OSError:
+        raise ConfigError('Unable to read keyfile')
+    if len(b) != sKeyfile:
+        raise ConfigError('Invalid key file size, expected ' + str(sKeyfile) + ' bytes')
 
 
 def validate_fints_config(config):
     if 'fints' not in config:
-        click.echo(click.style('Invalid config file: Does not contain fints section', fg='red'))
-        sys.exit(1)
+        raise ConfigError('Invalid config file: Does not contain fints section')
 
     for f in ('iban', 'blz', 'username', 'endpoint', 'pin'):
         if f not in config['fints']:
-            click.echo(click.style('Invalid config file: Does not contain value for fints.%s' % f, fg='red'))
-            sys.exit(1)
+            raise ConfigError('Invalid config file: Does not contain value for fints.%s' % f)
 
 
 def validate_pretix_config(config):
+    targets = [s for s in config.sections() if s.startswith('target:')]
+    if targets:
+        # Values missing in a target are taken from the [pretix] section
+        for s in targets:
+            for f in ('organizer', 'server', 'key'):
+                if f not in config[s] and not config.has_option('pretix', f):
+                    raise ConfigError('Invalid config file: Does not contain value for %s.%s' % (s, f))
+        return
+
     if 'pretix' not in config:
-        click.echo(click.style('Invalid config file: Does not contain pretix section', fg='red'))
-        sys.exit(1)
+        raise ConfigError('Invalid config file: Does not contain pretix section')
 
     for f in ('organizer', 'server', 'key'):
         if f not in config['pretix']:
-            click.echo(click.style('Invalid config file: Does not contain value for pretix.%s' % f, fg='red'))
-            sys.exit(1)
+            raise ConfigError('Invalid config file: Does not contain value for pretix.%s' % f)
 
 
 def get_endpoint(config):
@@ -85,5 +105,28 @@ def get_endpoint(config):
     )
 
 
+def get_state_file(config, suffix):
+    directory = config.get('banktool', 'statedir', fallback=None) or os.path.dirname(os.path.abspath(config.path))
+    name = os.path.splitext(os.path.basename(config.path))[0]
+    return os.path.join(directory, '{}.{}'.format(name, suffix))
+
+
+def get_account_label(config):
+    if config['banktool']['type'] == 'fints':
+        return config['fints']['iban']
+    elif config['banktool']['type'] == 'enablebanking':
+        return config['enablebanking']['aspspName']
+    return ''
+
+
+def is_interactive(config):
+    return config.getboolean('banktool', 'interactive', fallback=True)
+
+
 def get_pin(config):
-    return config['fints']['pin'] or click.prompt('Your online-banking PIN', hide_input=True)
+    if config['fints']['pin']:
+        return config['fints']['pin']
+    if not is_interactive(config):
+        raise InteractionRequired('No PIN for %s in the config file and prompting is disabled.' % config['fints']['iban'])
+    with prompt_lock:
+        return click.prompt('Your online-banking PIN for %s' % config['fints']['iban'], hide_input=True)
@@ -1,16 +1,34 @@
+import itertools
 import json
 import os
-import sys
+import queue
+import threading
+import time
 import click
 import uuid
 from datetime import datetime, timezone, timedelta
 from pprint import pprint
 from urllib.parse import urlparse, parse_qs
-import configparser
 
-import requests
 import jwt as pyjwt
-from .config import validate_config
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from . import metrics
+from .config import get_state_file
+from .exceptions import BankError
+from .transaction import Transaction
+from .transport import get_session
+
+_private_keys = {}
+_private_keys_lock = threading.Lock()
+
+
+def load_private_key(keyfile):
+    with _private_keys_lock:
+        if keyfile not in _private_keys:
+            with open(keyfile, "rb") as f:
+                _private_keys[keyfile] = load_pem_private_key(f.read(), password=None)
+        return _private_keys[keyfile]
+
 
 class EnableBanking:
     API_ORIGIN = "https://api.enablebanking.com"
@@ -18,36 +36,120 @@ class EnableBanking:
 
     def __init__(self, config):
         self.config = config
+        self.session = get_session(config)
+        self.api_origin = config.get("enablebanking", "api_origin", fallback=self.API_ORIGIN).rstrip("/")
+        self.cache_file = get_state_file(config, 'enablebanking.json')
+        self.lock = threading.RLock()
+        self.cache = self.loadCache()
+        self.checkpoints = []
+        self.authorize()
 
-        iat = int(datetime.now().timestamp())
-        jwt_body = {
-            "iss": "enablebanking.com",
-            "aud": "api.enablebanking.com",
-            "iat": iat,
-            "exp": iat + 3600,
-        }
+    def loadCache(self):
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
 
-        jwt = pyjwt.encode(
-            jwt_body,
-            open(self.config["enablebanking"]["keyfile"], "rb").read(),
-            algorithm="RS256",
-            headers={"kid": self.config["enablebanking"]["applicationId"]},
-        )
-        
-        self.base_headers = {"Authorization": f"Bearer {jwt}"}
+    def saveCache(self):
+        # The cache contains a valid bearer token, so it must not be readable by others
+        tmp = self.cache_file + '.tmp'
+        with self.lock:
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+                json.dump(self.cache, f)
+            os.replace(tmp, self.cache_file)
+
+    def authorize(self, force=False):
+        with self.lock:
+            self._authorize(force)
+
+    def _authorize(self, force=False):
+        application_id = self.config["enablebanking"]["applicationId"]
+        token = self.cache.get("jwt") or {}
+        now = int(datetime.now().timestamp())
+
+        if force or token.get("kid") != application_id or token.get("exp", 0) - 300 < now:
+            jwt_body = {
+                "iss": "enablebanking.com",
+                "aud": "api.enablebanking.com",
+                "iat": now,
+                "exp": now + 3600,
+            }
+
+            jwt = pyjwt.encode(
+                jwt_body,
+                load_private_key(self.config["enablebanking"]["keyfile"]),
+                algorithm="RS256",
+                headers={"kid": application_id},
+            )
+            token = {"kid": application_id, "token": jwt, "exp": jwt_body["exp"]}
+            self.cache["jwt"] = token
+            self.saveCache()
+
+        self.base_headers = {"Authorization": f"Bearer {token['token']}"}
+        self.jwt_exp = token["exp"]
+
+    def request(self, method, path, **kwargs):
+        # Long running processes keep this object around for longer than the token is valid
+        if self.jwt_exp - 60 < datetime.now().timestamp():
+            self.authorize()
+        r = self.session.request(method, f"{self.api_origin}{path}", headers=self.base_headers, **kwargs)
+        if r.status_code in (401, 403):
+            # The cached token or details might be stale, try once more with fresh ones
+            with self.lock:
+                self.cache.pop("application", None)
+                self.cache.pop("session", None)
+                self.authorize(force=True)
+            r = self.session.request(method, f"{self.api_origin}{path}", headers=self.base_headers, **kwargs)
+        return r
+
+    def getCached(self, name, key, path):
+        ttl = self.config.getint("enablebanking", "cache_ttl", fallback=3600)
+        entry = self.cache.get(name)
+        if entry and entry["key"] == key and entry["fetched"] + ttl > time.time():
+            return entry["data"]
+
+        r = self.request("GET", path)
+        if r.status_code != 200:
+            raise BankError(f"Error response {r.status_code}: {r.text}")
+        data = r.json()
+        self.cache[name] = {"key": key, "fetched": time.time(), "data": data}
+        self.saveCache()
+        return data
+
+    def getApplication(self):
+        return self.getCached("application", self.config["enablebanking"]["applicationId"], "/application")
+
+    def getSession(self):
+        session_id = self.config["enablebanking"]["sessionId"]
+        return self.getCached("session", session_id, f"/sessions/{session_id}")
+
+    def getAccounts(self, session):
+        accounts = session["accounts"]
+        ibans = [
+            i.strip().replace(" ", "")
+            for i in self.config.get("enablebanking", "ibans", fallback="").replace(",", "\n").splitlines()
+            if i.strip()
+        ]
+        if not ibans:
+            return accounts
+
+        selected = []
+        for account_uid in accounts:
+            details = self.getCached(f"account:{account_uid}", account_uid, f"/accounts/{account_uid}/details")
+            if details and (details.get("account_id") or {}).get("iban") in ibans:
+                selected.append(account_uid)
+        if not selected:
+            raise BankError('None of the accounts in the session matches enablebanking.ibans')
+        return selected
 
 
     def register(self, configfile):
             #Retrieve app details
-            r = requests.get(f"{self.API_ORIGIN}/application", headers=self.base_headers)
-            if r.status_code == 200:
-                app = r.json()
-                if self.debug:
-                    print("Application details:")
-                    pprint(app)
-            else:
-                print(f"Error response {r.status_code}:", r.text)
-                return
+            app = self.getApplication()
+            if self.debug:
+                print("Application details:")
+                pprint(app)
         
             # Starting authorization
             body = {
@@ -59,32 +161,32 @@ class EnableBanking:
                 "redirect_url": app["redirect_urls"][0],
                 "psu_type": "business",
             }
-            r = requests.post(f"{self.API_ORIGIN}/auth", json=body, headers=self.base_headers)
+            r = self.request("POST", "/auth", json=body)
             if r.status_code == 200:
                 auth_url = r.json()["url"]
                 print(f"To authenticate open URL {auth_url}")
             else:
-                print(f"Error response {r.status_code}:", r.text)
-                return
+                raise BankError(f"Error response {r.status_code}: {r.text}")
         
             ## Reading auth code and creating user session
             redirected_url = input("Paste here the URL you have been redirected to: ")
             auth_code = parse_qs(urlparse(redirected_url).query)["code"][0]
             
-            r = requests.post(f"{self.API_ORIGIN}/sessions", json={"code": auth_code}, headers=self.base_headers)
+            r = self.request("POST", "/sessions", json={"code": auth_code})
             if r.status_code == 200:
                 session = r.json()
                 if self.debug:
                     print("New user session has been created:")
                     pprint(session)
             else:
-                print(f"Error response {r.status_code}:", r.text)
-                return
+                raise BankError(f"Error response {r.status_code}: {r.text}")
         
             sessionId = session["session_id"]
 
             config = self.config
             config["enablebanking"]["sessionId"] = sessionId
+            self.cache.pop("session", None)
+            self.saveCache()
             
             if self.debug:
                 print("SessionID:", sessionId)
@@ -95,121 +197,242 @@ class EnableBanking:
             click.echo(click.style('Saved new session id to configfile', fg='green'))
 
 
-    def getPayload(self):
+    def getPayload(self, days=90):
         click.echo('Retrieving transactions from enable banking service')
 
-        # Requesting application details
-        r = requests.get(f"{self.API_ORIGIN}/application", headers=self.base_headers)
-        if r.status_code == 200:
-            app = r.json()
-            if self.debug:
-                print("Application details:")
-                pprint(app)
-        else:
-            print(f"Error response {r.status_code}:", r.text)
-            return
-        
         # Fetching session details
-        r = requests.get(f"{self.API_ORIGIN}/sessions/{self.config["enablebanking"]["sessionId"]}", headers=self.base_headers)
-        if r.status_code == 200:
-            if self.debug:
-                print("Session data:")
-                pprint(r.json())
-        else:
-            print(f"Error response {r.status_code}:", r.text)
-            return
-        
-        session = r.json()
-        account_uid = session["accounts"][0]
-        
-        ## Retrieving account transactions (since 90 days ago)
+        with metrics.current().phase('enablebanking.session'):
+            session = self.getSession()
+        if self.debug:
+            print("Session data:")
+            pprint(session)
+
+        accounts = self.getAccounts(session)
+        if not accounts:
+            raise BankError('The session does not give access to any accounts')
+
+        self.checkpoints = []
+
+        payload = {
+                'event': None,
+                'transactions': self.iterAccountsTransactions(accounts, days)
+                }
+
+        return payload
+
+    def iterPages(self, account_uid, date_from, continuation_key=None):
         query = {
-            "date_from": (datetime.now(timezone.utc) - timedelta(days=90)).date().isoformat(),
+            "date_from": date_from,
         }
-        continuation_key = None
-        data = list()
         while True:
             if continuation_key:
                 query["continuation_key"] = continuation_key
-            r = requests.get(
-                f"{self.API_ORIGIN}/accounts/{account_uid}/transactions",
-                params=query,
-                headers=self.base_headers,
-            )
+            m = metrics.current()
+            with m.phase('enablebanking.pagination'):
+                r = self.request(
+                    "GET",
+                    f"/accounts/{account_uid}/transactions",
+                    params=query,
+                )
+                m.count('enablebanking_pages')
             if r.status_code == 200:
                 resp_data = r.json()
-                data.append(resp_data)
                 if self.debug:
                     print("Transactions:")
-                    pprint(resp_data["transactions"])
+                    pprint(resp_data.get("transactions"))
+                yield resp_data
                 continuation_key = resp_data.get("continuation_key")
                 if not continuation_key:
                     print("No continuation key. All transactions were fetched")
                     break
                 print(f"Going to fetch more transactions with continuation key {continuation_key}")
             else:
-                print(f"Error response {r.status_code}:", r.text)
-                return None
-    
-        if len(data) == 0:
-            return None
-        
-        transactions = list()
+                # Transient errors have already been retried for this page, so this one is permanent
+                raise BankError(f"Error response {r.status_code}: {r.text}")
+
+    def iterAccountsTransactions(self, accounts, days=90):
+        if len(accounts) == 1:
+            yield from self.iterTransactions(accounts[0], days)
+            return
+
+        # Every account is paginated in its own thread. The queue is bounded, so the threads wait for the upload
+        # instead of collecting all transactions in memory.
+        q = queue.Queue(maxsize=len(accounts) * 2)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce(account_uid):
+            try:
+                page = []
+                for tx in self.iterTransactions(account_uid, days):
+                    page.append(tx)
+                    if len(page) >= 500:
+                        if not put(page):
+                            return
+                        page = []
+                put(page)
+                put(done)
+            except BaseException as e:
+                put(e)
+
+        click.echo('Fetching transactions of %d accounts' % len(accounts))
+        for account_uid in accounts:
+            threading.Thread(target=metrics.bind(produce), args=(account_uid,), daemon=True).start()
+
+        finished = 0
         try:
-            for d in data:
-                if not "transactions" in d:
-                    print("Missing transactions sections in retrieved data")
-                    continue
-                for e in d["transactions"]:
-                    if not "transaction_amount" in e or e["transaction_amount"] == None or not "amount" in e["transaction_amount"]:
-                        print("Missing transaction amount in retrieved data")
-                        continue
-                    amount = e["transaction_amount"]["amount"]
-
-                    if not "remittance_information" in e:
-                        print("Missing remittance_information in retrieved data")
-                        continue
-                    reference = ", ".join(e["remittance_information"])
-
-                    if not "debtor_account" in e or e["debtor_account"] == None or not "iban" in e["debtor_account"]:
-                        print("Missing iban in retrieved data")
-                        payer_iban = None
-                    else:
-                        payer_iban = e["debtor_account"]["iban"]
-
-                    if not "debtor" in e or e["debtor"] == None or not "name" in e["debtor"]:
-                        print("Missing debtor name in retrieved data")
-                        payer_name = None
-                    else:
-                        payer_name = e["debtor"]["name"]
-
-                    if not "booking_date" in e:
-                        print("Missing booking_date in retrieved data")
-                        continue
-                    date = e["booking_date"]
-
-                    if self.debug:
-                        print(amount, reference, payer_iban, payer_name, date)
-
-                    tx = {
-                            'amount': amount,
-                            'reference': reference,
-                            'payer': (payer_name or '') + ' - ' + (payer_iban or ''),
-                            'date': date,
-                    }
-                    transactions.append(tx)
-                    
-                    if self.debug:
-                        print(tx)
-        except Exception as e:
-            print(e)
-        
-        if len(transactions) == 0:
+            while finished < len(accounts):
+                item = q.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            stop.set()
+
+    def getCheckpointFile(self, account_uid):
+        return get_state_file(self.config, f"enablebanking.{account_uid}.checkpoint")
+
+    def loadCheckpoint(self, path):
+        # One JSON line with the query, then one line per completed page
+        ttl = self.config.getint("enablebanking", "checkpoint_ttl", fallback=86400)
+        pages = []
+        try:
+            with open(path) as f:
+                header = json.loads(f.readline())
+                if header["started"] + ttl < time.time():
+                    return None, []
+                for line in f:
+                    try:
+                        pages.append(json.loads(line))
+                    except ValueError:
+                        # The process died while writing this page
+                        break
+        except (OSError, ValueError, KeyError):
+            return None, []
+        return header, pages
+
+    def writeCheckpoint(self, path, entry, truncate=False):
+        # The checkpoint contains names and IBANs of payers, so it must not be readable by others
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else os.O_APPEND)
+        with os.fdopen(os.open(path, flags, 0o600), 'w') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clearCheckpoints(self):
+        for path in self.checkpoints:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.checkpoints = []
+
+    def iterTransactions(self, account_uid, days=90):
+        path = self.getCheckpointFile(account_uid)
+        self.checkpoints.append(path)
+        date_from = (datetime.now(timezone.utc) - timedelta(days=days)).date().isoformat()
+        continuation_key = None
+        stored = []
+
+        header, pages = self.loadCheckpoint(path)
+        if header is not None and header["date_from"] <= date_from:
+            # An earlier run did not finish, continue after its last complete page
+            click.echo(f"Resuming transactions of account {account_uid} after {len(pages)} pages")
+            date_from = header["date_from"]
+            stored = pages
+            if pages:
+                continuation_key = pages[-1]["continuation_key"]
+        else:
+            self.writeCheckpoint(path, {"date_from": date_from, "started": time.time()}, truncate=True)
+
+        fetched = self.iterPages(account_uid, date_from, continuation_key) if not stored or continuation_key else iter(())
+        first = None
+        if continuation_key:
+            # The bank may not accept the stored continuation key anymore. Nothing from the checkpoint has been
+            # handed out yet, so we can still start over without duplicates.
+            try:
+                first = next(fetched, None)
+            except BankError as e:
+                click.echo(click.style(f"Could not resume account {account_uid}, starting over: {e}", fg="yellow"))
+                date_from = (datetime.now(timezone.utc) - timedelta(days=days)).date().isoformat()
+                self.writeCheckpoint(path, {"date_from": date_from, "started": time.time()}, truncate=True)
+                stored = []
+                fetched = self.iterPages(account_uid, date_from)
+
+        for page in stored:
+            for t in page["transactions"]:
+                yield Transaction.from_json(t)
+
+        for d in itertools.chain([first] if first is not None else [], fetched):
+            transactions = self.convertPage(d)
+            self.writeCheckpoint(path, {
+                "continuation_key": d.get("continuation_key"),
+                "transactions": [tx.to_json() for tx in transactions],
+            })
+            yield from transactions
+
+    def convertPage(self, d):
+        transactions = []
+        if not "transactions" in d:
+            print("Missing transactions sections in retrieved data")
+            return transactions
+        for e in d["transactions"]:
+            try:
+                with metrics.current().phase('enablebanking.parse'):
+                    tx = self.convertTransaction(e)
+            except Exception as e:
+                print(e)
+                continue
+            if tx is not None:
+                transactions.append(tx)
+        return transactions
+
+    def convertTransaction(self, e):
+        if not "transaction_amount" in e or e["transaction_amount"] == None or not "amount" in e["transaction_amount"]:
+            print("Missing transaction amount in retrieved data")
             return None
-        
-        payload = {
-                'event': None,
-                'transactions': transactions
-                }
-        
-        return payload
+        amount = e["transaction_amount"]["amount"]
+
+        if not "remittance_information" in e:
+            print("Missing remittance_information in retrieved data")
+            return None
+        reference = ", ".join(e["remittance_information"])
+
+        if not "debtor_account" in e or e["debtor_account"] == None or not "iban" in e["debtor_account"]:
+            print("Missing iban in retrieved data")
+            payer_iban = None
+        else:
+            payer_iban = e["debtor_account"]["iban"]
+
+        if not "debtor" in e or e["debtor"] == None or not "name" in e["debtor"]:
+            print("Missing debtor name in retrieved data")
+            payer_name = None
+        else:
+            payer_name = e["debtor"]["name"]
+
+        if not "booking_date" in e:
+            print("Missing booking_date in retrieved data")
+            return None
+        date = e["booking_date"]
+
+        if self.debug:
+            print(amount, reference, payer_iban, payer_name, date)
+
+        tx = Transaction.from_parts(amount, reference, payer_name, payer_iban, date)
+
+        if self.debug:
+            print(tx)
+
+        return tx
@@ -0,0 +1,38 @@
+class BanktoolError(Exception):
+    # Exit code used by the command line interface and status reported in the metrics
+    exit_code = 1
+    status = 'failed'
+
+
+class ConfigError(BanktoolError):
+    pass
+
+
+class InputError(BanktoolError):
+    pass
+
+
+class BankError(BanktoolError):
+    pass
+
+
+class InteractionRequired(BankError):
+    # A PIN or TAN would have to be entered, but nobody is there to do it
+    exit_code = 3
+    status = 'input'
+
+
+class PretixError(BanktoolError):
+    exit_code = 2
+
+
+class UploadError(PretixError):
+    def __init__(self, message, jobs=(), failed=0):
+        super().__init__(message)
+        # Jobs of the batches that were uploaded before or besides the failed ones
+        self.jobs = list(jobs)
+        self.failed = failed
+
+
+class WaitTimeout(PretixError):
+    pass
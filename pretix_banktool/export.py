@@ -0,0 +1,30 @@
+import json
+import sys
+
+from .exceptions import InputError
+from .transaction import Transaction
+
+
+def write_ndjson(transactions, f):
+    count = 0
+    for tx in transactions:
+        f.write(json.dumps(tx.to_json()) + '\n')
+        count += 1
+    f.flush()
+    return count
+
+
+def iter_ndjson(path):
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        for i, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield Transaction.from_json(json.loads(line))
+            except (ValueError, KeyError) as e:
+                raise InputError('%s:%d: Invalid transaction: %s' % (path, i, e))
+    finally:
+        if f is not sys.stdin:
+            f.close()
@@ -0,0 +1,71 @@
+import re
+
+import click
+
+from .exceptions import ConfigError
+
+
+class IgnoreFilter:
+    def __init__(self, patterns):
+        self.patterns = []
+        for p in patterns:
+            if p in self.patterns:
+                continue
+            try:
+                re.compile(p)
+            except re.error as e:
+                raise ConfigError('Not a valid regular expression: %s ("%s" at position %d)' % (p, e.msg, e.pos))
+            self.patterns.append(p)
+        self.reset()
+        self.regex = None
+        self.fallback = []
+
+        if not self.patterns:
+            return
+        # All patterns are merged into one alternation, so every reference is scanned only once. Numbered
+        # backreferences and inline flags can not be combined like that, so those patterns are checked separately.
+        combined = []
+        for i, p in enumerate(self.patterns):
+            if re.search(r'\\[1-9]', p) or p.startswith('(?') and re.match(r'\(\?[aiLmsux]+\)', p):
+                self.fallback.append((i, re.compile(p)))
+            else:
+                combined.append('(?P<_ignore%d>%s)' % (i, p))
+        if combined:
+            try:
+                self.regex = re.compile('|'.join(combined))
+            except re.error:
+                self.regex = None
+                self.fallback = [(i, re.compile(p)) for i, p in enumerate(self.patterns)]
+
+    def reset(self):
+        self.hits = [0] * len(self.patterns)
+        self.ignored = 0
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def match(self, reference):
+        if self.regex:
+            m = self.regex.search(reference)
+            if m:
+                return int(m.lastgroup[len('_ignore'):])
+        for i, r in self.fallback:
+            if r.search(reference):
+                return i
+        return None
+
+    def filter(self, transactions):
+        for tx in transactions:
+            i = self.match(tx.reference)
+            if i is None:
+                yield tx
+            else:
+                self.hits[i] += 1
+                self.ignored += 1
+
+    def report(self):
+        if self.ignored > 0:
+            click.echo(click.style('Ignored %d transactions.' % self.ignored, fg='blue'))
+            for p, h in zip(self.patterns, self.hits):
+                if h:
+                    click.echo('    %6d  %s' % (h, p))
@@ -1,34 +1,90 @@
-import re
-import sys
+import base64
+import json
+import os
 from datetime import date, timedelta
 
 import click
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from fints.client import FinTS3PinTanClient, FinTSClientMode
-from pretix_banktool import __version__
-from pretix_banktool.config import get_pin
+from fints.models import SEPAAccount
+from pretix_banktool import __version__, metrics
+from pretix_banktool.config import get_pin, get_state_file
+from pretix_banktool.exceptions import BankError
+from pretix_banktool.transaction import Transaction
 from pretix_banktool.utils import ask_for_tan
 
+
+def _state_key(pin, salt):
+    kdf = Scrypt(salt=salt, length=32, n=2 ** 14, r=8, p=1)
+    return base64.urlsafe_b64encode(kdf.derive(pin.encode()))
+
+
 class FinTs:
-    def getPayload(config, days=30, pending=False, bank_ids=False, ignore=None):
-        ignore = ignore or []
-        ignore_patterns = []
-        for i in ignore:
-            try:
-                ignore_patterns.append(re.compile(i))
-            except re.error as e:
-                click.echo(click.style('Not a valid regular expression: %s' % i, fg='red'))
-                click.echo(click.style('"%s" at position %d' % (e.msg, e.pos), fg='red'))
+    def __init__(self, config):
+        self.config = config
+        self.client = None
+        self.account = None
+        self.pin = None
+        self.state_file = get_state_file(config, 'fints.state')
+        self.store_state = config.getboolean('fints', 'store_state', fallback=True)
+
+    def loadState(self):
+        # The client state contains the bank's system id and the chosen TAN mechanism. Restoring it saves
+        # several round trips and often a TAN. It is encrypted with the PIN, so it is only usable together with it.
+        if not self.store_state:
+            return None
+        try:
+            with open(self.state_file) as f:
+                stored = json.load(f)
+            data = json.loads(Fernet(_state_key(self.pin, base64.b64decode(stored['salt']))).decrypt(
+                stored['token'].encode()
+            ))
+        except (OSError, ValueError, KeyError, InvalidToken):
+            return None
+
+        if data.get('blz') != self.config['fints']['blz'] or data.get('username') != self.config['fints']['username']:
+            return None
+        if data.get('account') and data['account'].get('iban') == self.config['fints']['iban']:
+            self.account = SEPAAccount(**data['account'])
+        return base64.b64decode(data['client'])
 
+    def saveState(self):
+        if not self.store_state:
+            return
+        data = {
+            'blz': self.config['fints']['blz'],
+            'username': self.config['fints']['username'],
+            'client': base64.b64encode(self.client.deconstruct(including_private=True)).decode(),
+            'account': self.account._asdict() if self.account else None,
+        }
+        salt = os.urandom(16)
+        stored = {
+            'salt': base64.b64encode(salt).decode(),
+            'token': Fernet(_state_key(self.pin, salt)).encrypt(json.dumps(data).encode()).decode(),
+        }
+        tmp = self.state_file + '.tmp'
+        with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(stored, f)
+        os.replace(tmp, self.state_file)
+
+    def getClient(self):
+        if self.client:
+            return self.client
+
+        config = self.config
         click.echo('Creating FinTS client...')
 
+        self.pin = get_pin(config)
         f = FinTS3PinTanClient(
             config['fints']['blz'],
             config['fints']['username'],
-            get_pin(config),
+            self.pin,
             config['fints']['endpoint'],
             mode=FinTSClientMode.INTERACTIVE,
             product_id='459BE10AAEE93C6AA90BE6FE3',
-            product_version=__version__
+            product_version=__version__,
+            from_data=self.loadState()
         )
 
         if not f.get_current_tan_mechanism():
@@ -66,85 +122,67 @@ class FinTs:
                     click.echo("Choosing first one since 'tan_medium' is not set in config file.")
                 f.set_tan_medium(s)
 
-        with f:
-            if f.init_tan_response:
-                ask_for_tan(f, f.init_tan_response)
-            click.echo('Fetching SEPA account list...')
-            accounts = ask_for_tan(f, f.get_sepa_accounts())
-            click.echo('Looking for correct SEPA account...')
-            accounts_matching = [a for a in accounts if a.iban == config['fints']['iban']]
-            if not accounts_matching:
-                click.echo(click.style('The specified SEPA account %s could not be found.' % config['fints']['iban'],
-                                    fg='red'))
-                click.echo('Only the following SEPA accounts were detected:')
-                click.echo(', '.join([a.iban for a in accounts]))
-                sys.exit(1)
-            elif len(accounts_matching) > 1:
-                click.echo(click.style('Multiple SEPA accounts match the given IBAN. We currently can not handle this '
-                                    'situation.',
-                                    fg='red'))
-                click.echo('Only the following SEPA accounts were detected:')
-                click.echo(', '.join([a.iban for a in accounts]))
-                sys.exit(1)
-
-            account = accounts_matching[0]
-            click.echo(click.style('Found matching SEPA account.', fg='green'))
-
-            click.echo('Fetching statement of the last %d days...' % days)
-            statement = ask_for_tan(
-                f,
-                f.get_transactions(
-                    account,
-                    date.today() - timedelta(days=days),
-                    date.today(),
-                    include_pending=pending
-                )
-            )
-            if statement:
-                click.echo(click.style('Found %d transactions.' % len(statement), fg='green'))
-                click.echo('Parsing...')
-
-                transactions = []
-                ignored = 0
-                for transaction in statement:
-                    reference = ' '.join(
-                        transaction.data.get(t)
-                        for t in (
-                            'posting_text', 'purpose', 'bank_reference', 'customer_reference'
-                        )
-                        if transaction.data.get(t)
+        self.client = f
+        return f
+
+    def getAccount(self, f):
+        if self.account:
+            return self.account
+
+        config = self.config
+        click.echo('Fetching SEPA account list...')
+        accounts = ask_for_tan(f, f.get_sepa_accounts(), config)
+        click.echo('Looking for correct SEPA account...')
+        accounts_matching = [a for a in accounts if a.iban == config['fints']['iban']]
+        if not accounts_matching:
+            raise BankError('The specified SEPA account %s could not be found. Only the following SEPA accounts were '
+                            'detected: %s' % (config['fints']['iban'], ', '.join([a.iban for a in accounts])))
+        elif len(accounts_matching) > 1:
+            raise BankError('Multiple SEPA accounts match the given IBAN. We currently can not handle this situation. '
+                            'Only the following SEPA accounts were detected: %s' % ', '.join([a.iban for a in accounts]))
+
+        self.account = accounts_matching[0]
+        click.echo(click.style('Found matching SEPA account.', fg='green'))
+        return self.account
+
+    def getPayload(self, days=30, pending=False, bank_ids=False):
+        m = metrics.current()
+        with m.phase('fints.client'):
+            f = self.getClient()
+
+        with m.phase('fints.dialog'):
+            with f:
+                if f.init_tan_response:
+                    ask_for_tan(f, f.init_tan_response, self.config)
+                with m.phase('fints.accounts'):
+                    account = self.getAccount(f)
+
+                click.echo('Fetching statement of the last %d days...' % days)
+                with m.phase('fints.statement'):
+                    statement = ask_for_tan(
+                        f,
+                        f.get_transactions(
+                            account,
+                            date.today() - timedelta(days=days),
+                            date.today(),
+                            include_pending=pending
+                        ),
+                        self.config
                     )
-                    payer = {
-                        'name': transaction.data.get('applicant_name', ''),
-                        'iban': transaction.data.get('applicant_iban', ''),
-                    }
-                    eref = transaction.data.get('end_to_end_reference', '')
-
-                    ignore = False
-                    for i in ignore_patterns:
-                        if i.search(reference):
-                            ignore = True
-                            ignored += 1
-                            break
-
-                    if not ignore:
-                        tx = {
-                            'amount': str(transaction.data['amount'].amount),
-                            'reference': reference + (' EREF: {}'.format(eref) if eref else ''),
-                            'payer': ((payer.get('name') or '') + ' - ' + (payer.get('iban') or '')).strip(),
-                            'date': transaction.data['date'].isoformat(),
-                        }
-                        if bank_ids and transaction.data.get('bank_reference'):
-                            tx['external_id'] = transaction.data.get('bank_reference')
-
-                        transactions.append(tx)
-
-                if ignored > 0:
-                    click.echo(click.style('Ignored %d transactions.' % ignored, fg='blue'))
-                payload = {
-                    'event': None,
-                    'transactions': transactions
-                }
-                return payload
-            else:
-                click.echo('No recent transaction found.')
+
+            self.saveState()
+
+        if statement:
+            click.echo(click.style('Found %d transactions.' % len(statement), fg='green'))
+            click.echo('Parsing...')
+
+            with m.phase('fints.parse'):
+                transactions = [Transaction.from_statement(t.data, bank_ids) for t in statement]
+
+            payload = {
+                'event': None,
+                'transactions': transactions
+            }
+            return payload
+        else:
+            click.echo('No recent transaction found.')
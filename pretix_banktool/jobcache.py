@@ -0,0 +1,41 @@
+import json
+import os
+
+
+class JobCache:
+    FINAL_STATES = ('completed', 'error')
+    MAX_JOBS = 1000
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        # Job ids as returned by the server, newest first and without gaps
+        self.order = data.get('order', [])
+        # Whether the order reaches back to the oldest job on the server
+        self.complete = data.get('complete', False)
+        self.jobs = data.get('jobs', {})
+        self.validators = data.get('validators', {})
+
+    def is_final(self, job):
+        return job is not None and job.get('state') in self.FINAL_STATES
+
+    def store(self, job):
+        if job is not None and 'id' in job:
+            self.jobs[str(job['id'])] = job
+
+    def save(self):
+        if len(self.order) > self.MAX_JOBS:
+            self.order = self.order[:self.MAX_JOBS]
+            self.complete = False
+        keep = {str(i) for i in self.order}
+        self.jobs = {k: v for k, v in self.jobs.items() if k in keep}
+        self.validators = {k: v for k, v in self.validators.items() if k in keep or k.startswith('list:')}
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'order': self.order, 'complete': self.complete, 'jobs': self.jobs, 'validators': self.validators}, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,51 @@
+import sqlite3
+from datetime import datetime, timezone
+
+
+class Ledger:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS uploaded ('
+            'hash TEXT PRIMARY KEY, '
+            'date TEXT, '
+            'uploaded_at TEXT NOT NULL'
+            ')'
+        )
+        # Ledgers written by older versions do not know which job a transaction was sent in
+        if 'job' not in [row[1] for row in self.db.execute('PRAGMA table_info(uploaded)')]:
+            self.db.execute('ALTER TABLE uploaded ADD COLUMN job INTEGER')
+        self.db.execute('CREATE INDEX IF NOT EXISTS uploaded_job ON uploaded (job)')
+        self.db.commit()
+        self.skipped = 0
+
+    def close(self):
+        self.db.close()
+
+    def filter(self, transactions):
+        known = {}
+        for tx in transactions:
+            h = tx.key()
+            # The bank can report two identical bookings, both of them need to end up in the same place
+            if h not in known:
+                known[h] = self.db.execute('SELECT 1 FROM uploaded WHERE hash = ?', (h,)).fetchone() is not None
+            if known[h]:
+                self.skipped += 1
+            else:
+                yield tx
+
+    def record(self, transactions, job=None):
+        now = datetime.now(timezone.utc).isoformat()
+        job_id = job.get('id') if job else None
+        self.db.executemany(
+            'INSERT OR IGNORE INTO uploaded (hash, date, uploaded_at, job) VALUES (?, ?, ?, ?)',
+            [(tx.key(), tx.date, now, job_id) for tx in transactions]
+        )
+        self.db.commit()
+
+    def forget_job(self, job):
+        # pretix accepted the job but could not process it, so its transactions have to be sent again
+        deleted = self.db.execute('DELETE FROM uploaded WHERE job = ?', (job['id'],)).rowcount
+        self.db.commit()
+        return deleted
@@ -1,15 +1,27 @@
 import configparser
+import contextlib
+import os
 from urllib.parse import urljoin
 import sys
 import click
-from .fints import FinTs
-from .config import validate_config
-from .testing import test_fints, test_pretix
-from .enablebanking import EnableBanking
-from .pretix import uploadPayload as pretix_upload
-from .pretix import listUploads as pretix_list
-
-@click.group()
+from .config import expand_configfiles, get_state_file, load_config, validate_config
+from .exceptions import BanktoolError
+from .metrics import report as report_metrics
+
+# Backends and their dependencies (fints, jwt, cryptography, mt940) are imported by the commands that need them, so
+# short commands like --help or listuploads start quickly.
+
+class Group(click.Group):
+    # The library raises exceptions, on the command line they become a red message and an exit code
+    def invoke(self, ctx):
+        try:
+            return super().invoke(ctx)
+        except BanktoolError as e:
+            click.echo(click.style(str(e), fg='red'))
+            sys.exit(e.exit_code)
+
+
+@click.group(cls=Group)
 def main():
     pass
 
@@ -18,14 +30,14 @@ def main():
 @click.argument('configfile', type=click.Path(exists=True))
 @click.option('--renew/--no-renew', default=False, help='Replace sessionid set in config file')
 def register(configfile, renew):
-    config = configparser.ConfigParser()
-    config.read(configfile)
+    config = load_config(configfile)
     validate_config(config, ignoreSessionIdMissing = True)
     if config["banktool"]["type"] == "enablebanking":
         if "sessionid" in config["enablebanking"] and not renew:
             click.echo(click.style('You already have a sessionid in your config. Running register is not possible.', fg='red'))
             sys.exit(1)
         click.echo(click.style('Procedure to register bank account to enablebanking service', fg='green'))
+        from .enablebanking import EnableBanking
         enableBanking = EnableBanking(config)
         enableBanking.register(configfile)
     else:
@@ -37,51 +49,196 @@ def register(configfile, renew):
 @click.option('--fints/--no-fints', default=True, help='Test FinTS connection')
 @click.option('--pretix/--no-pretix', default=True, help='Test pretix connection')
 def test(configfile, fints, pretix):
-    config = configparser.ConfigParser()
-    config.read(configfile)
+    from .testing import test_fints, test_pretix
+
+    config = load_config(configfile)
     validate_config(config)
     if config['banktool']['type'] == 'enablebanking':
         click.echo(click.style('Testing enablebanking is not supported', fg='red'))
     if config['banktool']['type'] == 'fints' and fints:
         test_fints(config)
     if pretix:
-        test_pretix(config)
+        from .routing import get_pretix_configs
+        for c in get_pretix_configs(config):
+            test_pretix(c)
 
 
 @main.command()
-@click.argument('configfile', type=click.Path(exists=True))
+@click.argument('configfiles', nargs=-1, required=True, type=click.Path(exists=True))
 @click.option('--last', default=1, help='Only show last n bank import on pretix instance')
 @click.option('--transactions/--no-transactions', default=False, help='Show individual transactions')
-def listuploads(configfile, last, transactions):
-    config = configparser.ConfigParser()
-    config.read(configfile)
-    validate_config(config)
-    pretix_list(config, last, transactions)
+@click.option('--cache/--no-cache', default=True, help='Keep finished imports locally instead of downloading them again')
+@click.option('--jobs', default=4, help='Number of config files to process at the same time.')
+@click.option('--timings/--no-timings', default=False, help='Print the time spent in each phase.')
+@click.option('--json-log/--no-json-log', default=False, help='Print a JSON line with timings and counters to stderr.')
+@click.option('--prometheus', type=click.Path(dir_okay=False), help='Write metrics to this file for the Prometheus '
+                                                                    'textfile collector.')
+def listuploads(configfiles, last, transactions, cache, jobs, timings, json_log, prometheus):
+    from .jobcache import JobCache
+    from .pretix import listUploads as pretix_list
+    from .routing import get_pretix_configs
+    from .sync import forget_failed_job, get_ledger, run_configs
+
+    def run(config):
+        for c in get_pretix_configs(config):
+            # Transactions of imports that failed in pretix are removed from the ledger, if there is one
+            ledger = get_ledger(c) if os.path.exists(get_state_file(c, 'ledger.sqlite')) else None
+            pretix_list(c, last, transactions, JobCache(get_state_file(c, 'jobs.json')) if cache else None,
+                        forget_failed_job(ledger) if ledger else None)
+
+    run_configs(expand_configfiles(configfiles), run, jobs,
+                lambda results: report_metrics(results, timings, json_log, prometheus))
 
 @main.command()
-@click.argument('configfile', type=click.Path(exists=True))
+@click.argument('configfiles', nargs=-1, required=True, type=click.Path(exists=True))
 @click.option('--days', default=30, help='Number of days to go back.')
+@click.option('--auto-window/--no-auto-window', default=False,
+              help='Only fetch transactions since the latest one in the newest completed import in pretix. '
+                   'Falls back to --days if there is none.')
 @click.option('--pending/--no-pending', default=False, help='Include pending transactions.')
 @click.option('--bank-ids/--no-bank-ids', default=False, help='Include transaction IDs given by bank.')
 @click.option('--ignore', help='Ignore all references that match the given regular expression. '
-                               'Can be passed multiple times.', multiple=True)
-def upload(configfile, days, pending, bank_ids, ignore):
-    config = configparser.ConfigParser()
-    config.read(configfile)
-    validate_config(config)
+                               'Can be passed multiple times and is added to banktool.ignore from the config file.',
+              multiple=True)
+@click.option('--ledger/--no-ledger', default=True, help='Skip transactions that have already been uploaded '
+                                                         'from this machine.')
+@click.option('--jobs', default=4, help='Number of config files to process at the same time.')
+@click.option('--timings/--no-timings', default=False, help='Print the time spent in each phase.')
+@click.option('--json-log/--no-json-log', default=False, help='Print a JSON line with timings and counters to stderr.')
+@click.option('--prometheus', type=click.Path(dir_okay=False), help='Write metrics to this file for the Prometheus '
+                                                                    'textfile collector.')
+@click.option('--export', type=click.Path(dir_okay=False, allow_dash=True),
+              help='Write the transactions to this NDJSON file (- for stdout) instead of uploading them. '
+                   'Use the replay command to upload them later.')
+@click.option('--wait/--no-wait', default=False, help='Wait until pretix has processed the uploaded transactions and '
+                                                      'print the results.')
+@click.option('--wait-timeout', default=300, help='Maximum number of seconds to wait with --wait.')
+@click.option('--transactions/--no-transactions', default=False, help='Print payer names of new payments with --wait.')
+@click.option('--non-interactive', is_flag=True, help='Fail instead of asking for a PIN or TAN. Confirmations in '
+                                                      'a banking app (decoupled TAN) are still waited for.')
+def upload(configfiles, days, auto_window, pending, bank_ids, ignore, ledger, jobs, timings, json_log, prometheus,
+           export, wait, wait_timeout, transactions, non_interactive):
+    from .sync import (
+        clear_checkpoints, export_payload, fetch_payload, get_backend, get_ignore_filter, run_configs, upload_payload,
+    )
 
-    payload = None
-    if config['banktool']['type'] == 'enablebanking':
-        click.echo(click.style('Ignoring all given parameters. Not supported for enable banking at the moment', fg='red'))
-        eb = EnableBanking(config)
-        payload = eb.getPayload()
+    configfiles = expand_configfiles(configfiles)
+    if export and len(configfiles) > 1:
+        click.echo(click.style('--export can only be used with a single config file.', fg='red'))
+        sys.exit(1)
 
-    elif config['banktool']['type'] == 'fints':
-        finTs = FinTs()
-        payload = finTs.getPayload(config, days, pending, bank_ids, ignore)
+    def run(config):
+        if non_interactive:
+            config['banktool']['interactive'] = 'false'
+        if config['banktool']['type'] == 'enablebanking' and (days != 30 or pending or bank_ids):
+            click.echo(click.style('Ignoring --days, --pending and --bank-ids. Not supported for enable banking at the '
+                                   'moment', fg='red'))
+
+        ignore_filter = get_ignore_filter(config, ignore)
+        backend = get_backend(config)
+        payload = fetch_payload(config, backend, days, pending, bank_ids, auto_window)
+        if payload != None:
+            if export:
+                export_payload(payload, output if export == '-' else export, ignore_filter)
+            else:
+                upload_payload(config, payload, ledger, ignore_filter, wait_timeout if wait else None, transactions)
+            clear_checkpoints(config, backend)
+
+    # When exporting to stdout, all messages go to stderr so that the output stays valid NDJSON
+    output = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr) if export == '-' else contextlib.nullcontext():
+        run_configs(configfiles, run, jobs, lambda results: report_metrics(results, timings, json_log, prometheus))
+
+
+@main.command()
+@click.argument('configfile', type=click.Path(exists=True))
+@click.argument('files', nargs=-1, required=True, type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--ignore', help='Ignore all references that match the given regular expression. '
+                               'Can be passed multiple times and is added to banktool.ignore from the config file.',
+              multiple=True)
+@click.option('--ledger/--no-ledger', default=True, help='Skip transactions that have already been uploaded '
+                                                         'from this machine.')
+def replay(configfile, files, ignore, ledger):
+    from . import api
+    from .export import iter_ndjson
+
+    config = api.open_config(configfile, pretix_only=True)
+
+    def read():
+        for f in files:
+            click.echo('Reading %s...' % f)
+            yield from iter_ndjson(f)
+
+    api.upload_transactions(config, read(), ledger, ignore)
+
+
+@main.command('import-file')
+@click.argument('configfile', type=click.Path(exists=True))
+@click.argument('files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['auto', 'mt940', 'camt']), default='auto',
+              help='Format of the statement files. By default, it is detected from the file content.')
+@click.option('--encoding', default='utf-8', help='Character encoding of MT940 files.')
+@click.option('--bank-ids/--no-bank-ids', default=False, help='Include transaction IDs given by bank.')
+@click.option('--ignore', help='Ignore all references that match the given regular expression. '
+                               'Can be passed multiple times and is added to banktool.ignore from the config file.',
+              multiple=True)
+@click.option('--ledger/--no-ledger', default=True, help='Skip transactions that have already been uploaded '
+                                                         'from this machine.')
+def import_file(configfile, files, fmt, encoding, bank_ids, ignore, ledger):
+    from . import api
+    from .statements import iter_statement_file
+
+    config = api.open_config(configfile, pretix_only=True)
+
+    def read():
+        for f in files:
+            click.echo('Reading %s...' % f)
+            yield from iter_statement_file(f, fmt, bank_ids, encoding)
+
+    api.upload_transactions(config, read(), ledger, ignore)
+
+
+@main.command()
+@click.argument('configfiles', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--interval', default=600, help='Default number of seconds between two syncs of an account. '
+                                              'Can be overridden with banktool.interval in the config file.')
+@click.option('--jitter', default=0.1, help='Randomly vary each interval by up to this fraction.')
+@click.option('--max-backoff', default=3600, help='Maximum number of seconds to wait after repeated failures.')
+@click.option('--days', default=30, help='Number of days to go back.')
+@click.option('--auto-window/--no-auto-window', default=False,
+              help='Only fetch transactions since the latest one in the newest completed import in pretix. '
+                   'Falls back to --days if there is none.')
+@click.option('--pending/--no-pending', default=False, help='Include pending transactions.')
+@click.option('--bank-ids/--no-bank-ids', default=False, help='Include transaction IDs given by bank.')
+@click.option('--ignore', help='Ignore all references that match the given regular expression. '
+                               'Can be passed multiple times and is added to banktool.ignore from the config file.',
+              multiple=True)
+@click.option('--ledger/--no-ledger', default=True, help='Skip transactions that have already been uploaded '
+                                                         'from this machine.')
+@click.option('--jobs', default=4, help='Number of accounts to sync at the same time.')
+@click.option('--timings/--no-timings', default=False, help='Print the time spent in each phase.')
+@click.option('--json-log/--no-json-log', default=False, help='Print a JSON line with timings and counters to stderr.')
+@click.option('--prometheus', type=click.Path(dir_okay=False), help='Write metrics to this file for the Prometheus '
+                                                                    'textfile collector.')
+@click.option('--non-interactive', is_flag=True, help='Fail instead of asking for a PIN or TAN. Confirmations in '
+                                                      'a banking app (decoupled TAN) are still waited for.')
+def watch(configfiles, interval, jitter, max_backoff, days, auto_window, pending, bank_ids, ignore, ledger, jobs,
+          timings, json_log, prometheus, non_interactive):
+    from .sync import get_ignore_filter
+    from .watch import WatchedAccount, watch as run_watch
 
-    if payload != None:
-        pretix_upload(config, payload)
+    accounts = []
+    for configfile in expand_configfiles(configfiles):
+        config = load_config(configfile)
+        validate_config(config)
+        if non_interactive:
+            config['banktool']['interactive'] = 'false'
+        accounts.append(WatchedAccount(
+            configfile, config, config.getint('banktool', 'interval', fallback=interval), ledger,
+            get_ignore_filter(config, ignore)
+        ))
+    run_watch(accounts, jitter, max_backoff, timings, json_log, prometheus, jobs, days=days, pending=pending,
+              bank_ids=bank_ids, auto_window=auto_window)
 
 
 @main.command()
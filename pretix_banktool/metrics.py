@@ -0,0 +1,158 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import click
+
+_current = contextvars.ContextVar('metrics', default=None)
+
+
+class Metrics:
+    def __init__(self, configfile='', account=''):
+        self.configfile = configfile
+        self.account = account
+        self.started = time.time()
+        self.status = 'ok'
+        self.phases = {}
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + duration
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def as_dict(self):
+        return {
+            'config': self.configfile,
+            'account': self.account,
+            'status': self.status,
+            'started': self.started,
+            'phases': dict(self.phases),
+            'counters': dict(self.counters),
+        }
+
+
+class NullMetrics:
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def count(self, name, n=1):
+        pass
+
+
+_null = NullMetrics()
+
+
+def current():
+    return _current.get() or _null
+
+
+@contextmanager
+def collect(metrics):
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def bind(fn):
+    # Worker threads do not inherit the context, so metrics of a sync would otherwise get lost in its upload threads
+    metrics = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(metrics)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return run
+
+
+def counted(transactions, name):
+    m = current()
+    for tx in transactions:
+        m.count(name)
+        yield tx
+
+
+def print_timings(results):
+    for m in results:
+        click.echo('')
+        click.echo(click.style('Timings for %s' % m.configfile, fg='blue'))
+        for name, duration in m.phases.items():
+            click.echo('    {:<32} {:9.3f}s'.format(name, duration))
+        for name, value in sorted(m.counters.items()):
+            click.echo('    {:<32} {:>10}'.format(name, value))
+
+
+def write_json_log(results, stream=None):
+    stream = stream or sys.stderr
+    for m in results:
+        stream.write(json.dumps(m.as_dict()) + '\n')
+    stream.flush()
+
+
+def _labels(**labels):
+    return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items())
+
+
+def write_prometheus(results, path):
+    lines = [
+        '# HELP pretix_banktool_phase_seconds Time spent in each phase of the last sync.',
+        '# TYPE pretix_banktool_phase_seconds gauge',
+    ]
+    for m in results:
+        for name, duration in m.phases.items():
+            lines.append('pretix_banktool_phase_seconds{%s} %f' % (_labels(config=m.configfile, phase=name), duration))
+    lines += [
+        '# HELP pretix_banktool_counter Requests, bytes and transactions of the last sync.',
+        '# TYPE pretix_banktool_counter gauge',
+    ]
+    for m in results:
+        for name, value in sorted(m.counters.items()):
+            lines.append('pretix_banktool_counter{%s} %d' % (_labels(config=m.configfile, name=name), value))
+    lines += [
+        '# HELP pretix_banktool_last_run_success Whether the last sync succeeded.',
+        '# TYPE pretix_banktool_last_run_success gauge',
+    ]
+    for m in results:
+        lines.append('pretix_banktool_last_run_success{%s} %d' % (_labels(config=m.configfile), m.status == 'ok'))
+    lines += [
+        '# HELP pretix_banktool_last_run_timestamp_seconds Start time of the last sync.',
+        '# TYPE pretix_banktool_last_run_timestamp_seconds gauge',
+    ]
+    for m in results:
+        lines.append('pretix_banktool_last_run_timestamp_seconds{%s} %f' % (_labels(config=m.configfile), m.started))
+
+    # The textfile collector must never see a partially written file
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
+
+
+def report(results, timings=False, json_log=False, prometheus=None):
+    if timings:
+        print_timings(results)
+    if json_log:
+        write_json_log(results)
+    if prometheus:
+        write_prometheus(results, prometheus)
@@ -1,86 +1,336 @@
+import gzip
+import itertools
 import click
-import requests
+import time
+from collections import deque
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from pretix_banktool import metrics
 from pretix_banktool.config import get_endpoint
+from pretix_banktool.exceptions import PretixError, UploadError, WaitTimeout
+from pretix_banktool.transport import get_session
 from requests import RequestException
-import sys
 import json
+import threading
+
+print_lock = threading.Lock()
+
+
+def iterBatches(transactions, max_count=0, max_bytes=0):
+    batch = []
+    size = 0
+    for tx in transactions:
+        tx_size = len(json.dumps(tx.to_json())) + 2 if max_bytes else 0
+        if batch and ((max_count and len(batch) >= max_count) or (max_bytes and size + tx_size > max_bytes)):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(tx)
+        size += tx_size
+    if batch:
+        yield batch
+
+
+def postJob(config, payload, compress=False):
+    headers = {
+        'Authorization': 'Token {}'.format(config['pretix']['key']),
+        'Content-Type': 'application/json',
+    }
+    body = json.dumps(payload).encode()
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+        body = gzip.compress(body)
 
-def uploadPayload(config, payload):
-    click.echo('Uploading transactions to pretix instance')
     try:
-        r = requests.post(get_endpoint(config), headers={
-            'Authorization': 'Token {}'.format(config['pretix']['key'])
-        }, json=payload, verify=not config.getboolean('pretix', 'insecure', fallback=False))
+        # Sending a job twice is fine since pretix skips known transactions, so the session may retry it on any
+        # connection error or 5xx response
+        r = get_session(config).post(get_endpoint(config), headers=headers, data=body, idempotent=True,
+                                     verify=not config.getboolean('pretix', 'insecure', fallback=False))
         if r.status_code == 201:
-            click.echo(click.style('Job uploaded.', fg='green'))
-        else:
-            click.echo(click.style('Invalid response code: %d' % r.status_code, fg='red'))
-            click.echo(r.text)
-            sys.exit(2)
+            return r.json()
+        click.echo(click.style('Invalid response code: %d' % r.status_code, fg='red'))
+        click.echo(r.text)
     except (RequestException, OSError) as e:
         click.echo(click.style('Connection error: %s' % str(e), fg='red'))
-        sys.exit(2)
     except ValueError as e:
         click.echo(click.style('Could not read response: %s' % str(e), fg='red'))
-        sys.exit(2)
-
-def listUploads(config, last, transactions):
-    def parseResponse(r):
-        d = json.loads(r.text)
-        c = int(d["count"])
-        for i, e in enumerate(d["results"]):
-            if i < c - last:
-                continue
-            new = 0
-            existing = 0
-            nomatch = 0
-            names = list()
-            unmatched = list()
-            if e != None and "transactions" in e:
-                for t in e["transactions"]:
-                    if t["state"] == "valid":
-                        new += 1
-                        names.append(t["payer"])
-                    elif t["state"] == "already":
-                        existing += 1
-                    elif t["state"] == "nomatch":
-                        unmatched.append(t)
-                        nomatch += 1
-                    else:
-                        print("Not implemented. State", t["state"])
-
-                print("Import", e["id"])
-                print(" "*3, new, "new payments")
-                print(" "*3, existing, "existing payments")
-                print(" "*3, nomatch, "unmatched payments")
-
-
-                if transactions and len(names) > 0:
-                    print(" "*3,"New payments from:", ", ".join(names))
-
-                if len(unmatched) > 0:
-                    print("Unmatched payments:")
-                    for t in unmatched:
-                        print("\tName:", t["payer"])
-                        print("\tReference:", t["reference"])
-                        print("\tAmount:", t["amount"])
-                        print()
-                print() #Empty line
+    return None
+
+
+def uploadPayload(config, payload, on_success=None):
+    with metrics.current().phase('pretix.upload'):
+        return _uploadPayload(config, payload, on_success)
+
+
+def _uploadPayload(config, payload, on_success=None):
+    click.echo('Uploading transactions to pretix instance')
+    max_count = config.getint('pretix', 'batch_size', fallback=1000)
+    max_bytes = config.getint('pretix', 'batch_bytes', fallback=0)
+    workers = max(config.getint('pretix', 'upload_workers', fallback=2), 1)
+    compress = config.getboolean('pretix', 'gzip', fallback=False)
+
+    jobs = []
+    failed = 0
+
+    def collect(future, batch):
+        nonlocal failed
+        job = future.result()
+        if job is None:
+            failed += 1
+            click.echo(click.style('Upload of %d transactions failed.' % len(batch), fg='red'))
+            return
+        jobs.append(job)
+        metrics.current().count('transactions_uploaded', len(batch))
+        click.echo(click.style('Job uploaded (%d transactions).' % len(batch), fg='green'))
+        # Called from this thread only, so callers do not need to care about thread safety
+        if on_success:
+            on_success(batch, job)
+
+    # Only a few batches are held in memory at any time, no matter how long the transaction stream is
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for batch in iterBatches(payload['transactions'], max_count, max_bytes):
+                job = dict(payload, transactions=[tx.to_json() for tx in batch])
+                pending.append((pool.submit(metrics.bind(postJob), config, job, compress), batch))
+                if len(pending) >= workers * 2:
+                    collect(*pending.popleft())
+        finally:
+            # Batches that were sent before the transactions could not be read any further are still recorded, so
+            # they are not sent again on the next run
+            while pending:
+                collect(*pending.popleft())
+
+    if failed:
+        raise UploadError('%d of %d uploads failed. Run the upload again to retry them.' % (failed, failed + len(jobs)),
+                          jobs, failed)
+    return jobs
+
+
+def printJob(e, transactions):
+    new = 0
+    existing = 0
+    nomatch = 0
+    names = list()
+    unmatched = list()
+    if e is not None and "transactions" in e:
+        for t in e["transactions"]:
+            if t["state"] == "valid":
+                new += 1
+                names.append(t["payer"])
+            elif t["state"] == "already":
+                existing += 1
+            elif t["state"] == "nomatch":
+                unmatched.append(t)
+                nomatch += 1
             else:
-                print("Invalid dataset", e)
-    
-    click.echo('Requesting banking imports from server...')
+                print("Not implemented. State", t["state"])
+
+        print("Import", e["id"])
+        print(" " * 3, new, "new payments")
+        print(" " * 3, existing, "existing payments")
+        print(" " * 3, nomatch, "unmatched payments")
+
+        if transactions and len(names) > 0:
+            print(" " * 3, "New payments from:", ", ".join(names))
+
+        if len(unmatched) > 0:
+            print("Unmatched payments:")
+            for t in unmatched:
+                print("\tName:", t["payer"])
+                print("\tReference:", t["reference"])
+                print("\tAmount:", t["amount"])
+                print()
+        print()
+    else:
+        print("Invalid dataset", e)
+
+
+def getJobsPage(config, params=None, url=None, validators=None):
+    headers = {'Authorization': 'Token {}'.format(config['pretix']['key'])}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
     try:
-        r = requests.get(get_endpoint(config), headers={'Authorization': 'Token {}'.format(config['pretix']['key'])})
-        if r.status_code == 200:
-            parseResponse(r)
+        r = get_session(config).get(url or get_endpoint(config), params=params, headers=headers,
+                                    verify=not config.getboolean('pretix', 'insecure', fallback=False))
+        if r.status_code == 304 and validators:
+            return None
+        elif r.status_code == 200:
+            if validators is not None:
+                validators.clear()
+                if r.headers.get('ETag'):
+                    validators['etag'] = r.headers['ETag']
+                if r.headers.get('Last-Modified'):
+                    validators['last_modified'] = r.headers['Last-Modified']
+            return r.json()
         else:
-            click.echo(click.style('Invalid response code: %d' % r.status_code, fg='red'))
-            click.echo(r.text)
-            sys.exit(2)
+            raise PretixError('Invalid response code: %d\n%s' % (r.status_code, r.text))
     except (RequestException, OSError) as e:
-        click.echo(click.style('Connection error: %s' % str(e), fg='red'))
-        sys.exit(2)
+        raise PretixError('Connection error: %s' % str(e))
     except ValueError as e:
-        click.echo(click.style('Could not read response: %s' % str(e), fg='red'))
-        sys.exit(2)
\ No newline at end of file
+        raise PretixError('Could not read response: %s' % str(e))
+
+
+def iterJobs(config, last):
+    return itertools.islice(_iterJobs(config, last), max(last, 0))
+
+
+def _iterJobs(config, last):
+    # At least two jobs are needed on the first page to tell whether the server honours the ordering
+    params = {'ordering': '-created', 'page_size': min(max(last, 2), 50)}
+    first = getJobsPage(config, params)
+    results = first['results']
+    count = int(first['count'])
+    per_page = len(results)
+    if not per_page:
+        return
+    pages = -(-count // per_page)
+
+    def fetch(page):
+        return getJobsPage(config, dict(params, page=page))['results']
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        if len(results) < 2 or results[0]['id'] > results[-1]['id']:
+            # The server returned the newest jobs first, so we only need the first few pages
+            yield from results
+            for page in pool.map(metrics.bind(fetch), range(2, min(pages, -(-last // per_page)) + 1)):
+                yield from page
+        else:
+            # Older pretix versions ignore the ordering, so we need to start at the last page
+            wanted = range(pages, max(count - last, 0) // per_page, -1)
+            for page in pool.map(metrics.bind(lambda p: results if p == 1 else fetch(p)), wanted):
+                yield from reversed(page)
+
+
+def iterCachedJobs(config, last, cache):
+    # Finished jobs never change. We only look at the newest jobs until we reach one we have seen
+    # before, everything older than that is known already.
+    # At least two jobs are needed to tell whether the server honours the ordering
+    page_size = min(max(last, 2), 10 if cache.order else 50)
+    fresh = []
+    tail = None
+    d = None
+    page = 1
+    while len(fresh) < last:
+        params = {'ordering': '-created', 'page_size': page_size, 'page': page}
+        d = getJobsPage(config, params, validators=cache.validators.setdefault('list:%d' % page_size, {}) if page == 1 else None)
+        if d is None:
+            tail = cache.order
+            break
+        results = d['results']
+        if page == 1 and len(results) >= 2 and results[0]['id'] < results[-1]['id']:
+            # The server does not support ordering, so we can not tell which jobs are new
+            yield from iterJobs(config, last)
+            return
+        known = set(cache.order)
+        for job in results:
+            if job['id'] in known:
+                tail = cache.order[cache.order.index(job['id']):]
+                break
+            fresh.append(job)
+        if tail is not None or not d.get('next'):
+            break
+        page += 1
+
+    if tail is None and d is not None:
+        # The order is replaced by the fresh jobs only
+        cache.complete = not d.get('next')
+    tail = tail or []
+    older = []
+    if tail and not cache.complete and len(fresh) + len(tail) < last:
+        # The cache does not reach back far enough, so the missing older jobs are fetched from where it ends
+        page_size = min(max(last, 2), 50)
+        page = (len(fresh) + len(tail)) // page_size + 1
+        while len(fresh) + len(tail) + len(older) < last:
+            d = getJobsPage(config, {'ordering': '-created', 'page_size': page_size, 'page': page})
+            oldest = older[-1]['id'] if older else tail[-1]
+            older += [job for job in d['results'] if job['id'] < oldest]
+            if not d.get('next'):
+                cache.complete = True
+                break
+            page += 1
+
+    for job in fresh + older:
+        cache.store(job)
+    cache.order = [job['id'] for job in fresh] + tail + [job['id'] for job in older]
+    yield from fresh[:last]
+
+    for job_id in tail[:max(last - len(fresh), 0)]:
+        job = cache.jobs.get(str(job_id))
+        if not cache.is_final(job):
+            job = getJobsPage(
+                config,
+                url='{}{}/'.format(get_endpoint(config), job_id),
+                validators=cache.validators.setdefault(str(job_id), {}) if job else None
+            ) or job
+            cache.store(job)
+        yield job
+
+    yield from older[:max(last - len(fresh) - len(tail), 0)]
+
+
+def waitForJobs(config, jobs, timeout=300, transactions=False, on_error=None):
+    # pretix processes the jobs asynchronously. Only the jobs we just created are polled, starting quickly and
+    # backing off since larger imports take a while.
+    click.echo('Waiting for pretix to process %d jobs...' % len(jobs))
+    deadline = time.monotonic() + timeout
+    done = []
+    with metrics.current().phase('pretix.wait'):
+        for job in jobs:
+            delay = 0.5
+            while job.get('state') in ('pending', 'running'):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WaitTimeout('Job %s was not processed within %d seconds.' % (job['id'], timeout))
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 10)
+                job = getJobsPage(config, url='{}{}/'.format(get_endpoint(config), job['id']))
+                metrics.current().count('pretix_job_polls')
+            # Uploads to several targets wait at the same time, their summaries must not interleave
+            with print_lock:
+                printJob(job, transactions)
+            if on_error and job.get('state') == 'error':
+                on_error(job)
+            done.append(job)
+    return done
+
+
+def getLatestTransactionDate(config, last=10):
+    # Only looks at the newest few jobs, a failed or empty job is skipped in favour of the one before
+    with metrics.current().phase('pretix.window'):
+        for job in iterJobs(config, last):
+            if job.get('state') != 'completed':
+                continue
+            dates = []
+            for t in job.get('transactions') or []:
+                try:
+                    dates.append(date.fromisoformat(str(t.get('date'))[:10]))
+                except ValueError:
+                    pass
+            if dates:
+                return max(dates)
+    return None
+
+
+def iterLatestJobs(config, last, cache=None):
+    jobs = iterCachedJobs(config, last, cache) if cache else iterJobs(config, last)
+    with metrics.current().phase('pretix.list'):
+        yield from itertools.islice(jobs, max(last, 0))
+    if cache:
+        cache.save()
+
+
+def getJobs(config, last, cache=None):
+    return list(iterLatestJobs(config, last, cache))
+
+
+def listUploads(config, last, transactions, cache=None, on_error=None):
+    click.echo('Requesting banking imports from server...')
+    # Every job is printed as soon as its page has arrived
+    for job in iterLatestJobs(config, last, cache):
+        printJob(job, transactions)
+        if on_error and job.get('state') == 'error':
+            on_error(job)
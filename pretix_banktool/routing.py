@@ -0,0 +1,76 @@
+import configparser
+import os
+import re
+from decimal import Decimal, InvalidOperation
+
+from .exceptions import ConfigError
+
+RULE_KEYS = ('event', 'reference', 'amount_min', 'amount_max', 'iban')
+
+
+def _decimal(section, key):
+    if not section.get(key):
+        return None
+    try:
+        return Decimal(section[key])
+    except InvalidOperation:
+        raise ConfigError('Invalid config file: %s.%s is not a number' % (section.name, key))
+
+
+class Target:
+    def __init__(self, config, section):
+        self.name = section.name[len('target:'):]
+        self.event = section.get('event') or None
+
+        # Each target gets a config of its own with the [pretix] section replaced, so the uploader, the ledger and
+        # the job cache work on it just like on a single organizer config
+        self.config = configparser.ConfigParser()
+        self.config.read_dict({
+            s: dict(config.items(s, raw=True)) for s in config.sections() if not s.startswith('target:')
+        })
+        pretix = dict(config.items('pretix', raw=True)) if config.has_section('pretix') else {}
+        pretix.update((k, v) for k, v in config.items(section.name, raw=True) if k not in RULE_KEYS)
+        self.config['pretix'] = pretix
+        stem, ext = os.path.splitext(config.path)
+        self.config.path = '{}.{}{}'.format(stem, self.name, ext)
+
+        try:
+            self.reference = re.compile(section['reference']) if section.get('reference') else None
+        except re.error as e:
+            raise ConfigError('Not a valid regular expression: %s ("%s" at position %d)' % (
+                section['reference'], e.msg, e.pos))
+        self.amount_min = _decimal(section, 'amount_min')
+        self.amount_max = _decimal(section, 'amount_max')
+        self.ibans = {
+            i.strip().replace(' ', '').upper()
+            for i in section.get('iban', '').replace(',', '\n').splitlines()
+            if i.strip()
+        }
+
+    def matches(self, tx):
+        if self.reference and not self.reference.search(tx.reference):
+            return False
+        if self.amount_min is not None or self.amount_max is not None:
+            try:
+                amount = Decimal(tx.amount)
+            except InvalidOperation:
+                return False
+            if self.amount_min is not None and amount < self.amount_min:
+                return False
+            if self.amount_max is not None and amount > self.amount_max:
+                return False
+        if self.ibans:
+            # The payer is stored as "name - IBAN", the name may be empty or contain dashes itself
+            iban = tx.payer.rsplit('-', 1)[-1].replace(' ', '').upper()
+            if iban not in self.ibans:
+                return False
+        return True
+
+
+def get_targets(config):
+    return [Target(config, config[s]) for s in config.sections() if s.startswith('target:')]
+
+
+def get_pretix_configs(config):
+    # Everything that talks to pretix without uploading runs once per target
+    return [t.config for t in get_targets(config)] or [config]
@@ -0,0 +1,131 @@
+import xml.etree.ElementTree as ET
+from decimal import Decimal, InvalidOperation
+
+import click
+import mt940
+
+from .transaction import Transaction
+
+
+def detect_format(path):
+    with open(path, 'rb') as f:
+        start = f.read(512).lstrip(b'\xef\xbb\xbf \t\r\n')
+    return 'camt' if start.startswith(b'<') else 'mt940'
+
+
+def _parse_mt940_block(lines):
+    # Same clean up as python-fints does before handing statements to mt940
+    data = ''.join(lines).replace('@@', '\r\n').replace('-0000', '+0000')
+    return mt940.models.Transactions().parse(data)
+
+
+def iter_mt940(path, encoding='utf-8'):
+    # Every statement starts with its transaction reference (:20:) and is parsed on its own, so only one
+    # statement is held in memory at a time
+    block = []
+    with open(path, encoding=encoding, errors='replace', newline='') as f:
+        for line in f:
+            if line.startswith(':20:') and any(b.startswith(':61:') for b in block):
+                yield from _parse_mt940_block(block)
+                block = []
+            block.append(line)
+    if block:
+        yield from _parse_mt940_block(block)
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _find(elem, path):
+    for part in path.split('/'):
+        if elem is None:
+            return None
+        elem = next((c for c in elem if _local(c.tag) == part), None)
+    return elem
+
+
+def _findall(elem, path):
+    *parents, last = path.split('/')
+    if parents:
+        elem = _find(elem, '/'.join(parents))
+    if elem is None:
+        return []
+    return [c for c in elem if _local(c.tag) == last]
+
+
+def _text(elem, path):
+    e = _find(elem, path)
+    return e.text.strip() if e is not None and e.text else ''
+
+
+def _camt_entry_data(entry, details):
+    debit = _text(entry, 'CdtDbtInd') == 'DBIT'
+    amount = _text(details, 'Amt') or _text(details, 'AmtDtls/TxAmt/Amt') or _text(entry, 'Amt')
+    try:
+        amount = Decimal(amount)
+    except InvalidOperation:
+        return None, 'no valid amount'
+    date = _text(entry, 'BookgDt/Dt') or _text(entry, 'BookgDt/DtTm')[:10]
+    if not date:
+        return None, 'no booking date'
+    if debit:
+        amount = -amount
+
+    # The applicant is the other party of the booking, as in MT940
+    party = 'Cdtr' if debit else 'Dbtr'
+    name = _text(details, 'RltdPties/%s/Nm' % party) or _text(details, 'RltdPties/%s/Pty/Nm' % party)
+    eref = _text(details, 'Refs/EndToEndId')
+    return {
+        'amount': amount,
+        'date': date,
+        'posting_text': _text(entry, 'AddtlNtryInf'),
+        'purpose': ' '.join(e.text.strip() for e in _findall(details, 'RmtInf/Ustrd') if e.text),
+        'bank_reference': _text(details, 'Refs/AcctSvcrRef') or _text(entry, 'AcctSvcrRef'),
+        'applicant_name': name,
+        'applicant_iban': _text(details, 'RltdPties/%sAcct/Id/IBAN' % party),
+        'end_to_end_reference': '' if eref == 'NOTPROVIDED' else eref,
+    }, None
+
+
+def iter_camt(path):
+    stmt = None
+    position = 0
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        tag = _local(elem.tag)
+        if event == 'start':
+            if tag in ('Stmt', 'Rpt', 'Ntfctn'):
+                stmt = elem
+            continue
+        if tag != 'Ntry':
+            continue
+        position += 1
+
+        status = _find(elem, 'Sts')
+        if status is None or 'PDNG' not in ''.join(status.itertext()):
+            details = _findall(elem, 'NtryDtls/TxDtls')
+            if len(details) > 1 and not all(_text(d, 'Amt') or _text(d, 'AmtDtls/TxAmt/Amt') for d in details):
+                # A batch booking without individual amounts can only be reported as a whole
+                details = details[:1]
+            for d in details or [None]:
+                data, error = _camt_entry_data(elem, d)
+                if data is None:
+                    click.echo(click.style('%s: Skipping entry %d with %s.' % (path, position, error), fg='red'))
+                    continue
+                yield data
+
+        # Drop everything we have already seen, so memory use does not grow with the file
+        elem.clear()
+        if stmt is not None and elem in stmt:
+            stmt.remove(elem)
+
+
+def iter_statement_file(path, fmt='auto', bank_ids=False, encoding='utf-8'):
+    if fmt == 'auto':
+        fmt = detect_format(path)
+    if fmt == 'camt':
+        for data in iter_camt(path):
+            yield Transaction.from_statement(data, bank_ids)
+    else:
+        for t in iter_mt940(path, encoding):
+            yield Transaction.from_statement(t.data, bank_ids)
@@ -0,0 +1,274 @@
+import contextlib
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import click
+
+from . import metrics
+from .config import get_account_label, get_state_file, load_config, validate_config
+from .exceptions import BankError, BanktoolError, ConfigError, InteractionRequired, UploadError
+from .export import write_ndjson
+from .filters import IgnoreFilter
+from .ledger import Ledger
+from .pretix import getLatestTransactionDate, uploadPayload as pretix_upload, waitForJobs
+from .routing import get_pretix_configs, get_targets
+
+
+def get_backend(config):
+    if config['banktool']['type'] == 'enablebanking':
+        from .enablebanking import EnableBanking
+        return EnableBanking(config)
+    elif config['banktool']['type'] == 'fints':
+        from .fints import FinTs
+        return FinTs(config)
+
+
+def get_ledger(config):
+    return Ledger(get_state_file(config, 'ledger.sqlite'))
+
+
+def forget_failed_job(ledger):
+    def forget(job):
+        if ledger.forget_job(job):
+            click.echo(click.style('Import %s failed in pretix, its transactions will be uploaded again on the next run.'
+                                   % job['id'], fg='yellow'))
+    return forget
+
+
+def get_ignore_filter(config, ignore=()):
+    patterns = [p.strip() for p in config.get('banktool', 'ignore', fallback='').splitlines() if p.strip()]
+    return IgnoreFilter(patterns + list(ignore))
+
+
+def get_auto_window(config):
+    # With several targets, the window has to reach back to the one that is the furthest behind
+    dates = [getLatestTransactionDate(c) for c in get_pretix_configs(config)]
+    latest = None if None in dates else min(dates)
+    if latest is None:
+        click.echo('No completed import found in pretix, using the default window.')
+        return None
+    overlap = config.getint('banktool', 'auto_window_overlap', fallback=2)
+    days = max((date.today() - latest).days, 0) + overlap
+    click.echo('Latest imported transaction is from %s, fetching the last %d days.' % (latest.isoformat(), days))
+    return days
+
+
+def fetch_payload(config, backend, days=30, pending=False, bank_ids=False, auto_window=False):
+    window = get_auto_window(config) if auto_window else None
+    if config['banktool']['type'] == 'enablebanking':
+        return backend.getPayload(window) if window is not None else backend.getPayload()
+    return backend.getPayload(window if window is not None else days, pending, bank_ids)
+
+
+def clear_checkpoints(config, backend):
+    # Called once the fetched transactions are safe, so the next run does not resume from them
+    if config['banktool']['type'] == 'enablebanking':
+        backend.clearCheckpoints()
+
+
+def open_ledger(config, ledger=True):
+    # The ledger is opened for a single upload and closed afterwards, since an SQLite connection can only be used by
+    # the thread that opened it
+    return contextlib.closing(get_ledger(config)) if ledger else contextlib.nullcontext()
+
+
+def upload_payload(config, payload, ledger=True, ignore=None, wait=None, show_transactions=False):
+    transactions = metrics.counted(payload['transactions'], 'transactions_fetched')
+    if ignore:
+        ignore.reset()
+        transactions = ignore.filter(transactions)
+    targets = get_targets(config)
+    if targets:
+        # Every target has a ledger of its own, there is none for the config itself
+        jobs = upload_routed(payload, transactions, targets, ledger, wait, show_transactions)
+    else:
+        with open_ledger(config, ledger) as db:
+            jobs = upload_filtered(config, dict(payload, transactions=transactions), db, wait, show_transactions)
+    if ignore:
+        ignore.report()
+        metrics.current().count('transactions_ignored', ignore.ignored)
+    if not jobs:
+        click.echo('No new transactions to upload.')
+    return jobs
+
+
+def upload_filtered(config, payload, ledger=None, wait=None, show_transactions=False):
+    transactions = payload['transactions']
+    if ledger:
+        ledger.skipped = 0
+        transactions = ledger.filter(transactions)
+    jobs = pretix_upload(config, dict(payload, transactions=transactions), on_success=ledger.record if ledger else None)
+    if ledger:
+        metrics.current().count('transactions_skipped', ledger.skipped)
+    if ledger and ledger.skipped:
+        click.echo(click.style('Skipped %d transactions that have already been uploaded.' % ledger.skipped, fg='blue'))
+    if wait is not None and jobs:
+        jobs = waitForJobs(config, jobs, wait, show_transactions, forget_failed_job(ledger) if ledger else None)
+    return jobs
+
+
+def upload_routed(payload, transactions, targets, ledger=True, wait=None, show_transactions=False):
+    # The transactions are read once and handed to one upload thread per target through bounded queues, so a
+    # statement is only fetched from the bank once no matter how many organizers share the account
+    click.echo('Routing transactions to %d targets' % len(targets))
+    queues = [queue.Queue(maxsize=1000) for _ in targets]
+    stopped = [threading.Event() for _ in targets]
+    done = object()
+    aborted = object()
+
+    def put(i, item):
+        while not stopped[i].is_set():
+            try:
+                queues[i].put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def consume(i):
+        while True:
+            item = queues[i].get()
+            if item is done:
+                return
+            elif item is aborted:
+                raise BankError('Fetching the transactions failed.')
+            yield item
+
+    def upload(i):
+        target = targets[i]
+        try:
+            with open_ledger(target.config, ledger) as db:
+                return upload_filtered(
+                    target.config,
+                    dict(payload, event=target.event, transactions=consume(i)),
+                    db,
+                    wait,
+                    show_transactions
+                )
+        finally:
+            stopped[i].set()
+
+    unrouted = 0
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        futures = [pool.submit(metrics.bind(upload), i) for i in range(len(targets))]
+        try:
+            for tx in transactions:
+                matched = False
+                for i, target in enumerate(targets):
+                    if target.matches(tx):
+                        matched = True
+                        put(i, tx)
+                if not matched:
+                    unrouted += 1
+        except BaseException:
+            for i in range(len(targets)):
+                put(i, aborted)
+            raise
+        for i in range(len(targets)):
+            put(i, done)
+
+    metrics.current().count('transactions_unrouted', unrouted)
+    if unrouted:
+        click.echo(click.style('%d transactions did not match any target and were not uploaded.' % unrouted,
+                               fg='yellow'))
+
+    jobs = []
+    failed = 0
+    for target, future in zip(targets, futures):
+        try:
+            jobs += future.result()
+        except BanktoolError as e:
+            failed += 1
+            click.echo(click.style('Target %s: %s' % (target.name, e), fg='red'))
+            if isinstance(e, UploadError):
+                jobs += e.jobs
+    if failed:
+        raise UploadError('Uploads to %d of %d targets failed.' % (failed, len(targets)), jobs, failed)
+    return jobs
+
+
+def _run(configfile, func, m):
+    with metrics.collect(m), m.phase('total'):
+        config = load_config(configfile)
+        validate_config(config)
+        m.account = get_account_label(config)
+        func(config)
+
+
+def export_payload(payload, path, ignore=None):
+    transactions = metrics.counted(payload['transactions'], 'transactions_fetched')
+    if ignore:
+        ignore.reset()
+        transactions = ignore.filter(transactions)
+    if hasattr(path, 'write'):
+        count = write_ndjson(transactions, path)
+    else:
+        with open(path, 'w') as f:
+            count = write_ndjson(transactions, f)
+    if ignore:
+        ignore.report()
+    click.echo(click.style('Exported %d transactions.' % count, fg='green'))
+
+
+def run_config(configfile, func):
+    m = metrics.Metrics(configfile)
+    try:
+        _run(configfile, func, m)
+    except KeyboardInterrupt:
+        raise
+    except SystemExit as e:
+        if e.code:
+            m.status = 'failed'
+    except BanktoolError as e:
+        click.echo(click.style('%s: %s' % (configfile, e), fg='red'))
+        m.status = e.status
+    except Exception as e:
+        click.echo(click.style('%s: %s' % (configfile, e), fg='red'))
+        traceback.print_exc()
+        m.status = 'failed'
+    return m
+
+
+def run_configs(configfiles, func, jobs=4, report=None):
+    if not configfiles:
+        raise ConfigError('No config files found.')
+    elif len(configfiles) == 1:
+        m = metrics.Metrics(configfiles[0])
+        try:
+            _run(configfiles[0], func, m)
+        except SystemExit as e:
+            if e.code:
+                m.status = 'failed'
+            raise
+        except BaseException as e:
+            m.status = getattr(e, 'status', 'failed')
+            raise
+        finally:
+            if report:
+                report([m])
+        return [m]
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        results = list(pool.map(lambda c: run_config(c, func), configfiles))
+
+    click.echo('')
+    click.echo(click.style('Summary', fg='blue'))
+    width = max(len(m.configfile) for m in results)
+    for m in results:
+        click.echo('    {}  {:<34}  {}  {:7.1f}s'.format(
+            m.configfile.ljust(width),
+            m.account,
+            click.style(m.status.ljust(6), fg='green' if m.status == 'ok' else 'red'),
+            m.phases.get('total', 0),
+        ))
+    if report:
+        report(results)
+    failed = [m for m in results if m.status != 'ok']
+    if failed and all(m.status == InteractionRequired.status for m in failed):
+        # Lets unattended runs tell "somebody has to enter a TAN" apart from real errors
+        raise InteractionRequired('%d of %d syncs need a PIN or TAN.' % (len(failed), len(results)))
+    elif failed:
+        raise BanktoolError('%d of %d syncs failed.' % (len(failed), len(results)))
+    return results
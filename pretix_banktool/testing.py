@@ -1,18 +1,20 @@
 import pprint
-import sys
 from datetime import date, timedelta
 
 import click
-import requests
-from fints.client import FinTS3PinTanClient, FinTSClientMode
 from pretix_banktool import __version__
 from requests import RequestException
 
 from .config import get_endpoint, get_pin
-from .utils import ask_for_tan
+from .exceptions import BankError
+from .transport import get_session
 
 
 def test_fints(config):
+    from fints.client import FinTS3PinTanClient, FinTSClientMode
+
+    from .utils import ask_for_tan
+
     click.echo('Creating FinTS client...')
     f = FinTS3PinTanClient(
         config['fints']['blz'],
@@ -61,31 +63,26 @@ def test_fints(config):
 
     with f:
         if f.init_tan_response:
-            ask_for_tan(f, f.init_tan_response)
+            ask_for_tan(f, f.init_tan_response, config)
 
         click.echo('Fetching SEPA account list...')
-        accounts = ask_for_tan(f, f.get_sepa_accounts())
+        accounts = ask_for_tan(f, f.get_sepa_accounts(), config)
         click.echo('Looking for correct SEPA account...')
         accounts_matching = [a for a in accounts if a.iban == config['fints']['iban']]
         if not accounts_matching:
-            click.echo(click.style('The specified SEPA account %s could not be found.' % config['fints']['iban'],
-                                   fg='red'))
-            click.echo('Only the following SEPA accounts were detected:')
-            click.echo(', '.join([a.iban for a in accounts]))
-            sys.exit(1)
+            raise BankError('The specified SEPA account %s could not be found. Only the following SEPA accounts were '
+                            'detected: %s' % (config['fints']['iban'], ', '.join([a.iban for a in accounts])))
         elif len(accounts_matching) > 1:
-            click.echo(click.style('Multiple SEPA accounts match the given IBAN. We currently can not handle this '
-                                   'situation.',
-                                   fg='red'))
-            click.echo('Only the following SEPA accounts were detected:')
-            click.echo(', '.join([a.iban for a in accounts]))
-            sys.exit(1)
+            raise BankError('Multiple SEPA accounts match the given IBAN. We currently can not handle this situation. '
+                            'Only the following SEPA accounts were detected: %s' % ', '.join([a.iban for a in accounts]))
 
         account = accounts_matching[0]
         click.echo(click.style('Found matching SEPA account.', fg='green'))
 
         click.echo('Fetching statement of the last 14 days...')
-        statement = ask_for_tan(f, f.get_transactions(account, date.today() - timedelta(days=14), date.today()))
+        statement = ask_for_tan(
+            f, f.get_transactions(account, date.today() - timedelta(days=14), date.today()), config
+        )
         if statement:
             click.echo(click.style('Found %d transactions. The last one is:' % len(statement), fg='green'))
             pprint.pprint(statement[-1].data)
@@ -96,7 +93,7 @@ def test_fints(config):
 def test_pretix(config):
     click.echo('Testing pretix connection...')
     try:
-        r = requests.get(get_endpoint(config), headers={
+        r = get_session(config).get(get_endpoint(config), headers={
             'Authorization': 'Token {}'.format(config['pretix']['key'])
         }, verify=not config.getboolean('pretix', 'insecure', fallback=False))
         if 'results' in r.json():
@@ -0,0 +1,67 @@
+import hashlib
+import json
+
+
+class Transaction:
+    __slots__ = ('amount', 'reference', 'payer', 'date', 'external_id')
+
+    def __init__(self, amount, reference, payer, date, external_id=None):
+        self.amount = str(amount)
+        self.reference = reference or ''
+        self.payer = (payer or '').strip()
+        self.date = date if isinstance(date, str) else date.isoformat()
+        self.external_id = external_id or None
+
+    @classmethod
+    def from_parts(cls, amount, reference, payer_name, payer_iban, date, external_id=None):
+        return cls(amount, reference, (payer_name or '') + ' - ' + (payer_iban or ''), date, external_id)
+
+    @classmethod
+    def from_statement(cls, data, bank_ids=False):
+        # data is a MT940 transaction as returned by FinTS or read from a statement file, or a
+        # CAMT entry converted to the same keys
+        amount = data['amount']
+        reference = ' '.join(
+            data.get(t)
+            for t in (
+                'posting_text', 'purpose', 'bank_reference', 'customer_reference'
+            )
+            if data.get(t)
+        )
+        eref = data.get('end_to_end_reference', '')
+        return cls.from_parts(
+            getattr(amount, 'amount', amount),
+            reference + (' EREF: {}'.format(eref) if eref else ''),
+            data.get('applicant_name', ''),
+            data.get('applicant_iban', ''),
+            data['date'],
+            data.get('bank_reference') if bank_ids else None,
+        )
+
+    @classmethod
+    def from_json(cls, d):
+        return cls(d['amount'], d.get('reference'), d.get('payer'), d['date'], d.get('external_id'))
+
+    def to_json(self):
+        d = {
+            'amount': self.amount,
+            'reference': self.reference,
+            'payer': self.payer,
+            'date': self.date,
+        }
+        if self.external_id:
+            d['external_id'] = self.external_id
+        return d
+
+    def key(self):
+        data = json.dumps([self.amount, self.date, self.reference, self.payer, self.external_id])
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def __eq__(self, other):
+        return isinstance(other, Transaction) and all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, a) for a in self.__slots__))
+
+    def __repr__(self):
+        return '<Transaction {} {} {!r} {!r}>'.format(self.date, self.amount, self.payer, self.reference)
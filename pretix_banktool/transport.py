@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+RETRY_STATUS = (429, 502, 503, 504)
+# Responses that guarantee that the server did not process the request, so even a POST can be sent again
+RETRY_STATUS_UNSAFE = (429, 503)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def get_bucket(host, rate, burst):
+    # Shared by all sessions of this process, so concurrent syncs against the same API stay below its quota together
+    with _buckets_lock:
+        if host not in _buckets:
+            _buckets[host] = TokenBucket(rate, burst)
+        return _buckets[host]
+
+
+def retry_after(r):
+    value = r.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class Session(requests.Session):
+    def __init__(self, timeout=None, pool_size=10, keepalive=True, retries=5, backoff=1, max_backoff=60,
+                 rate_limit=0, rate_burst=10):
+        super().__init__()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        if not keepalive:
+            self.headers['Connection'] = 'close'
+
+    def delay(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        # Callers may declare a POST idempotent if sending it twice does no harm, it is then retried like a GET
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        bucket = get_bucket(urlparse(url).netloc, self.rate_limit, self.rate_burst) if self.rate_limit else None
+        m = metrics.current()
+
+        attempt = 0
+        while True:
+            if bucket:
+                bucket.take()
+            try:
+                r = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # Without a response we only know that nothing was processed if we could not even connect
+                if attempt >= self.retries or not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                    raise
+                m.count('http_retries')
+                time.sleep(self.delay(attempt))
+                attempt += 1
+                continue
+
+            m.count('http_requests')
+            m.count('http_bytes_sent', len(r.request.body or b''))
+            m.count('http_bytes_received', len(r.content))
+
+            if attempt < self.retries and r.status_code in (RETRY_STATUS if idempotent else RETRY_STATUS_UNSAFE):
+                m.count('http_retries')
+                wait = retry_after(r)
+                time.sleep(min(wait, self.max_backoff) if wait is not None else self.delay(attempt))
+                attempt += 1
+                continue
+            return r
+
+
+def get_session(config):
+    pool_size = config.getint('http', 'pool_size', fallback=10)
+    timeout = (
+        config.getfloat('http', 'connect_timeout', fallback=10) or None,
+        config.getfloat('http', 'timeout', fallback=120) or None,
+    )
+    keepalive = config.getboolean('http', 'keepalive', fallback=True)
+    retry = (
+        config.getint('http', 'retries', fallback=5),
+        config.getfloat('http', 'backoff', fallback=1),
+        config.getfloat('http', 'max_backoff', fallback=60),
+        config.getfloat('http', 'rate_limit', fallback=0),
+        config.getint('http', 'rate_burst', fallback=10),
+    )
+
+    # All syncs running in this process share their connections as long as they use the same settings
+    key = (pool_size, timeout, keepalive) + retry
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = Session(timeout, pool_size, keepalive, *retry)
+        return _sessions[key]
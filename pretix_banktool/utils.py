@@ -1,17 +1,58 @@
+import time
+
 import click
 from fints.client import NeedTANResponse
 from fints.hhd.flicker import terminal_flicker_unix
 
+from . import metrics
+from .config import get_account_label, is_interactive, prompt_lock
+from .exceptions import BankError, InteractionRequired
+
+
+def _for_account(config):
+    return " for %s" % get_account_label(config) if config is not None else ""
+
+
+def ask_for_tan(f, response, config=None):
+    m = metrics.current()
+    while isinstance(response, NeedTANResponse):
+        m.count('tan_requests')
+        if getattr(response, 'decoupled', False):
+            response = wait_for_decoupled_tan(f, response, config)
+            continue
+        if config is not None and not is_interactive(config):
+            raise InteractionRequired('The bank requires a TAN and prompting is disabled: %s' % response.challenge)
+        with prompt_lock, m.phase('tan_wait'):
+            # Several accounts may be synced at the same time, so the user needs to know which one this is for
+            click.echo(click.style("A TAN is required" + _for_account(config), fg="red"))
+            click.echo(response.challenge)
+            if getattr(response, 'challenge_hhduc', None):
+                try:
+                    terminal_flicker_unix(response.challenge_hhduc)
+                except KeyboardInterrupt:
+                    pass
+            tan = input('Please enter TAN:')
+        response = f.send_tan(response, tan)
+    return response
+
 
-def ask_for_tan(f, response):
-    if not isinstance(response, NeedTANResponse):
-        return response
-    click.echo(click.style("A TAN is required", fg="red"))
+def wait_for_decoupled_tan(f, response, config=None):
+    # The TAN is confirmed in the banking app. Nothing needs to be entered, we ask the bank until it is done.
+    timeout = config.getint('fints', 'decoupled_timeout', fallback=300) if config is not None else 300
+    click.echo(click.style("Please confirm the request%s in your banking app" % _for_account(config), fg="yellow"))
     click.echo(response.challenge)
-    if getattr(response, 'challenge_hhduc', None):
-        try:
-            terminal_flicker_unix(response.challenge_hhduc)
-        except KeyboardInterrupt:
-            pass
-    tan = input('Please enter TAN:')
-    return f.send_tan(response, tan)
+    m = metrics.current()
+    deadline = time.monotonic() + timeout
+    delay = 2
+    with m.phase('tan_wait'):
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise BankError('The request was not confirmed in the banking app within %d seconds.' % timeout)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 1.5, 15)
+            m.count('tan_polls')
+            result = f.send_tan(response, '')
+            if not isinstance(result, NeedTANResponse) or not getattr(result, 'decoupled', False):
+                return result
+            response = result
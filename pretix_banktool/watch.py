@@ -0,0 +1,103 @@
+import heapq
+import random
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import click
+
+from . import metrics
+from .exceptions import BanktoolError
+from .sync import clear_checkpoints, fetch_payload, get_backend, upload_payload
+
+
+class WatchedAccount:
+    def __init__(self, configfile, config, interval, ledger=True, ignore=None):
+        self.configfile = configfile
+        self.config = config
+        self.interval = interval
+        self.use_ledger = ledger
+        self.ignore = ignore
+        self.backend = None
+        self.failures = 0
+        self.metrics = None
+
+    def sync(self, **kwargs):
+        # Clients are created once and kept, so later syncs reuse the bank dialog setup and HTTP state
+        if self.backend is None:
+            self.backend = get_backend(self.config)
+        payload = fetch_payload(self.config, self.backend, **kwargs)
+        if payload is not None:
+            upload_payload(self.config, payload, self.use_ledger, self.ignore)
+            clear_checkpoints(self.config, self.backend)
+
+    def next_delay(self, jitter, max_backoff):
+        if self.failures:
+            delay = min(self.interval * 2 ** self.failures, max(max_backoff, self.interval))
+        else:
+            delay = self.interval
+        return delay * (1 + random.uniform(-jitter, jitter))
+
+
+def sync_account(account, **kwargs):
+    click.echo(click.style('Syncing %s' % account.configfile, fg='blue'))
+    account.metrics = metrics.Metrics(account.configfile)
+    try:
+        with metrics.collect(account.metrics), account.metrics.phase('total'):
+            account.sync(**kwargs)
+    except KeyboardInterrupt:
+        raise
+    except (Exception, SystemExit) as e:
+        # A broken account must not end the loop for all other accounts. The client is thrown away since
+        # its dialog state is unknown after an error.
+        account.failures += 1
+        account.backend = None
+        account.metrics.status = 'failed'
+        if isinstance(e, SystemExit):
+            click.echo(click.style('Sync of %s failed.' % account.configfile, fg='red'))
+        elif isinstance(e, BanktoolError):
+            account.metrics.status = e.status
+            click.echo(click.style('Sync of %s failed: %s' % (account.configfile, e), fg='red'))
+        else:
+            click.echo(click.style('Sync of %s failed: %s' % (account.configfile, e), fg='red'))
+            traceback.print_exc()
+    else:
+        account.failures = 0
+
+
+def watch(accounts, jitter=0.1, max_backoff=3600, timings=False, json_log=False, prometheus=None, jobs=4, **kwargs):
+    # Spread the first syncs a little so that many accounts do not hit their banks at the same second
+    queue = [(time.monotonic() + random.uniform(0, jitter * a.interval), i) for i, a in enumerate(accounts)]
+    heapq.heapify(queue)
+    jobs = max(jobs, 1)
+    running = {}
+
+    # Syncs run in a pool, so a slow bank or a pending TAN only holds up its own account. An account is either
+    # waiting in the queue or running, never both.
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while queue or running:
+            while queue and len(running) < jobs and queue[0][0] <= time.monotonic():
+                due, i = heapq.heappop(queue)
+                running[pool.submit(sync_account, accounts[i], **kwargs)] = i
+
+            timeout = None
+            if queue and len(running) < jobs:
+                timeout = max(queue[0][0] - time.monotonic(), 0)
+            if not running:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                i = running.pop(future)
+                account = accounts[i]
+                future.result()
+
+                metrics.report([account.metrics], timings, json_log)
+                if prometheus:
+                    metrics.write_prometheus([a.metrics for a in accounts if a.metrics], prometheus)
+
+                delay = account.next_delay(jitter, max_backoff)
+                if account.failures:
+                    click.echo(click.style('Retrying %s in %d seconds.' % (account.configfile, delay), fg='yellow'))
+                heapq.heappush(queue, (time.monotonic() + delay, i))
@@ -0,0 +1,124 @@
+import configparser
+import os
+
+import pytest
+
+from pretix_banktool.enablebanking import EnableBanking
+from pretix_banktool.exceptions import BankError
+
+
+class Response:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+        self.text = 'error'
+
+    def json(self):
+        return self.data
+
+
+class Bank:
+    # Four pages with three transactions each, the continuation key is the number of the next page
+    def __init__(self):
+        self.requests = []
+        self.fail = set()
+
+    def request(self, method, path, params=None, **kwargs):
+        key = params.get('continuation_key', '0')
+        self.requests.append(key)
+        if key in self.fail:
+            return Response(400)
+        page = int(key)
+        return Response(200, {
+            'transactions': [
+                {
+                    'transaction_amount': {'amount': '%d.00' % (page * 3 + i + 1), 'currency': 'EUR'},
+                    'remittance_information': ['Order %d' % (page * 3 + i)],
+                    'debtor': {'name': 'Jane'},
+                    'debtor_account': {'iban': 'DE00'},
+                    'booking_date': '2026-01-01',
+                }
+                for i in range(3)
+            ],
+            'continuation_key': str(page + 1) if page < 3 else None,
+        })
+
+
+@pytest.fixture
+def backend(tmp_path):
+    config = configparser.ConfigParser()
+    config.read_dict({'banktool': {'type': 'enablebanking'}, 'enablebanking': {}})
+    config.path = str(tmp_path / 'org.cfg')
+
+    def make(bank):
+        # Skips the authorization, the bank stand-in does not check tokens
+        b = EnableBanking.__new__(EnableBanking)
+        b.config = config
+        b.checkpoints = []
+        b.debug = False
+        b.request = bank.request
+        return b
+    return make
+
+
+def references(transactions):
+    return [int(t.reference.split()[-1]) for t in transactions]
+
+
+def fetch_until_error(backend):
+    fetched = []
+    with pytest.raises(BankError):
+        for tx in backend.iterTransactions('acc'):
+            fetched.append(tx)
+    return fetched
+
+
+def test_resume_after_last_complete_page(backend):
+    bank = Bank()
+    bank.fail = {'2'}
+    assert references(fetch_until_error(backend(bank))) == list(range(6))
+
+    bank.fail = set()
+    bank.requests.clear()
+    b = backend(bank)
+    assert references(b.iterTransactions('acc')) == list(range(12))
+    # Pages that are in the checkpoint are not requested again
+    assert bank.requests == ['2', '3']
+
+    b.clearCheckpoints()
+    assert not os.path.exists(b.getCheckpointFile('acc'))
+
+
+def test_start_over_when_continuation_key_is_rejected(backend, capsys):
+    bank = Bank()
+    bank.fail = {'2'}
+    fetch_until_error(backend(bank))
+
+    # The stored key is rejected, but a fresh pagination works
+    bank.requests.clear()
+    bank.fail = set()
+    original = bank.request
+
+    def request(method, path, params=None, **kwargs):
+        if params.get('continuation_key') == '2' and bank.requests.count('2') == 0:
+            bank.requests.append('2')
+            return Response(400)
+        return original(method, path, params=params, **kwargs)
+
+    bank.request = request
+    assert references(backend(bank).iterTransactions('acc')) == list(range(12))
+    assert bank.requests == ['2', '0', '1', '2', '3']
+    assert 'starting over' in capsys.readouterr().out
+
+
+def test_expired_checkpoint(backend):
+    bank = Bank()
+    bank.fail = {'2'}
+    b = backend(bank)
+    fetch_until_error(b)
+
+    b.config['enablebanking']['checkpoint_ttl'] = '-1'
+    bank.fail = set()
+    bank.requests.clear()
+    assert references(backend(bank).iterTransactions('acc')) == list(range(12))
+    assert bank.requests == ['0', '1', '2', '3']
@@ -0,0 +1,51 @@
+import pytest
+
+from pretix_banktool.exceptions import ConfigError
+from pretix_banktool.filters import IgnoreFilter
+from pretix_banktool.transaction import Transaction
+
+
+def tx(reference):
+    return Transaction('1.00', reference, 'Payer - DE00', '2026-01-01')
+
+
+def test_empty():
+    f = IgnoreFilter([])
+    assert not f
+    assert f.match('anything') is None
+
+
+def test_match_returns_first_pattern():
+    f = IgnoreFilter(['^Bank fee', 'Internal', 'fee'])
+    assert f.match('Bank fee January') == 0
+    assert f.match('Internal transfer') == 1
+    assert f.match('Order ABC') is None
+
+
+def test_duplicates_are_dropped():
+    f = IgnoreFilter(['fee', 'fee'])
+    assert f.patterns == ['fee']
+
+
+def test_backreferences_and_inline_flags():
+    f = IgnoreFilter([r'(\d)\1', '(?i)refund', 'Order'])
+    assert f.match('Ticket 33') == 0
+    assert f.match('REFUND 12') == 1
+    assert f.match('Order 12') == 2
+    assert f.match('order 12') is None
+
+
+def test_invalid_pattern():
+    with pytest.raises(ConfigError):
+        IgnoreFilter(['(unclosed'])
+
+
+def test_filter_counts_hits():
+    f = IgnoreFilter(['fee', 'Internal'])
+    kept = list(f.filter([tx('Order 1'), tx('Bank fee'), tx('fee again'), tx('Internal')]))
+    assert [t.reference for t in kept] == ['Order 1']
+    assert f.hits == [2, 1]
+    assert f.ignored == 3
+    f.reset()
+    assert f.hits == [0, 0]
+    assert f.ignored == 0
@@ -0,0 +1,106 @@
+import configparser
+
+import pytest
+
+from pretix_banktool import pretix
+from pretix_banktool.jobcache import JobCache
+from pretix_banktool.pretix import getJobs
+
+
+class Server:
+    def __init__(self, count, ordered=True):
+        self.jobs = []
+        self.ordered = ordered
+        self.requests = []
+        for i in range(count):
+            self.add()
+
+    def add(self, state='completed'):
+        self.jobs.append({'id': len(self.jobs) + 1, 'state': state, 'transactions': []})
+
+    def get(self, config, params=None, url=None, validators=None):
+        self.requests.append(dict(params or {}, url=url))
+        if url:
+            return dict(self.jobs[int(url.rstrip('/').rsplit('/', 1)[-1]) - 1])
+        etag = str(len(self.jobs))
+        if validators is not None:
+            if validators.get('etag') == etag:
+                return None
+            validators['etag'] = etag
+        jobs = list(reversed(self.jobs)) if self.ordered else self.jobs
+        page_size = min(params.get('page_size', 50), 50)
+        start = (params.get('page', 1) - 1) * page_size
+        return {
+            'count': len(jobs),
+            'next': 'next' if start + page_size < len(jobs) else None,
+            'results': [dict(j) for j in jobs[start:start + page_size]],
+        }
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = configparser.ConfigParser()
+    config.read_dict({'pretix': {'server': 'https://pretix.example', 'organizer': 'org', 'key': 'key'}})
+    config.path = str(tmp_path / 'org.cfg')
+    return config
+
+
+def ids(jobs):
+    return [j['id'] for j in jobs]
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_growing_last(config, tmp_path, monkeypatch, ordered):
+    server = Server(100, ordered)
+    monkeypatch.setattr(pretix, 'getJobsPage', server.get)
+    path = str(tmp_path / 'jobs.json')
+
+    assert ids(getJobs(config, 1, JobCache(path))) == [100]
+    assert ids(getJobs(config, 5, JobCache(path))) == [100, 99, 98, 97, 96]
+    assert ids(getJobs(config, 30, JobCache(path))) == list(range(100, 70, -1))
+    assert ids(getJobs(config, 3, JobCache(path))) == [100, 99, 98]
+    assert ids(getJobs(config, 200, JobCache(path))) == list(range(100, 0, -1))
+
+
+def test_new_jobs_are_added(config, tmp_path, monkeypatch):
+    server = Server(10)
+    monkeypatch.setattr(pretix, 'getJobsPage', server.get)
+    path = str(tmp_path / 'jobs.json')
+
+    assert ids(getJobs(config, 3, JobCache(path))) == [10, 9, 8]
+    server.add()
+    server.add()
+    assert ids(getJobs(config, 6, JobCache(path))) == [12, 11, 10, 9, 8, 7]
+    assert JobCache(path).order == [12, 11, 10, 9, 8, 7]
+
+
+def test_unchanged_list_and_pending_jobs(config, tmp_path, monkeypatch):
+    server = Server(5)
+    server.add('pending')
+    monkeypatch.setattr(pretix, 'getJobsPage', server.get)
+    path = str(tmp_path / 'jobs.json')
+
+    assert [j['state'] for j in getJobs(config, 2, JobCache(path))] == ['pending', 'completed']
+    server.jobs[-1]['state'] = 'completed'
+    server.requests.clear()
+    # The list is answered from the cache, only the unfinished job is requested again
+    assert [j['state'] for j in getJobs(config, 2, JobCache(path))] == ['completed', 'completed']
+    assert [r['url'] for r in server.requests if r['url']] == ['https://pretix.example/api/v1/organizers/org/bankimportjobs/6/']
+    assert ids(getJobs(config, 4, JobCache(path))) == [6, 5, 4, 3]
+
+
+def test_complete_cache_needs_one_request(config, tmp_path, monkeypatch):
+    server = Server(20)
+    monkeypatch.setattr(pretix, 'getJobsPage', server.get)
+    path = str(tmp_path / 'jobs.json')
+
+    assert ids(getJobs(config, 5, JobCache(path))) == list(range(20, 15, -1))
+    assert ids(getJobs(config, 200, JobCache(path))) == list(range(20, 0, -1))
+    assert JobCache(path).complete
+    server.requests.clear()
+    assert ids(getJobs(config, 200, JobCache(path))) == list(range(20, 0, -1))
+    assert len(server.requests) == 1
+
+    # A cache that only holds the newest jobs does not count as complete
+    assert ids(getJobs(config, 2, JobCache(str(tmp_path / 'other.json')))) == [20, 19]
+    assert not JobCache(str(tmp_path / 'other.json')).complete
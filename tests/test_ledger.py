@@ -0,0 +1,66 @@
+import configparser
+import sqlite3
+
+from pretix_banktool import sync
+from pretix_banktool.ledger import Ledger
+from pretix_banktool.transaction import Transaction
+
+
+def transactions(n):
+    return [Transaction('1.00', 'Order %d' % i, 'Jane - DE00', '2026-01-01') for i in range(n)]
+
+
+def test_filter_and_record(tmp_path):
+    ledger = Ledger(str(tmp_path / 'ledger.sqlite'))
+    txs = transactions(3)
+    ledger.record(txs[:2], {'id': 7})
+    assert list(ledger.filter(txs)) == txs[2:]
+    assert ledger.skipped == 2
+
+
+def test_forget_job(tmp_path):
+    ledger = Ledger(str(tmp_path / 'ledger.sqlite'))
+    txs = transactions(3)
+    ledger.record(txs[:2], {'id': 7})
+    ledger.record(txs[2:], {'id': 8})
+    assert ledger.forget_job({'id': 7}) == 2
+    assert list(ledger.filter(txs)) == txs[:2]
+
+
+def test_migrates_old_ledger(tmp_path):
+    path = str(tmp_path / 'ledger.sqlite')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE uploaded (hash TEXT PRIMARY KEY, date TEXT, uploaded_at TEXT NOT NULL)')
+    db.execute("INSERT INTO uploaded VALUES ('abc', '2026-01-01', '2026-01-01T00:00:00')")
+    db.commit()
+    db.close()
+
+    ledger = Ledger(path)
+    assert ledger.forget_job({'id': 1}) == 0
+    assert ledger.db.execute('SELECT job FROM uploaded').fetchall() == [(None,)]
+
+
+def test_targets_have_own_ledgers(tmp_path, monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'banktool': {'type': 'fints'},
+        'pretix': {'server': 'https://pretix.example'},
+        'target:a': {'organizer': 'a'},
+        'target:b': {'organizer': 'b', 'reference': '^B'},
+    })
+    config.path = str(tmp_path / 'org.cfg')
+    uploaded = {}
+
+    def upload(config, payload, on_success=None):
+        batch = list(payload['transactions'])
+        uploaded[config['pretix']['organizer']] = batch
+        on_success(batch, {'id': 1})
+        return [{'id': 1}]
+
+    monkeypatch.setattr(sync, 'pretix_upload', upload)
+    sync.upload_payload(config, {'event': None, 'transactions': iter(transactions(2))})
+
+    assert len(uploaded['a']) == 2
+    assert len(uploaded['b']) == 0
+    assert not (tmp_path / 'org.ledger.sqlite').exists()
+    assert list(Ledger(str(tmp_path / 'org.a.ledger.sqlite')).filter(transactions(2))) == []
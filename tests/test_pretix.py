@@ -0,0 +1,56 @@
+import configparser
+import json
+
+import pytest
+
+from pretix_banktool import pretix
+from pretix_banktool.exceptions import BankError
+from pretix_banktool.pretix import iterBatches, uploadPayload
+from pretix_banktool.transaction import Transaction
+
+
+def transactions(n):
+    return [Transaction('1.00', 'Order %d' % i, 'Jane - DE00', '2026-01-01') for i in range(n)]
+
+
+def test_no_limit():
+    assert [len(b) for b in iterBatches(transactions(5))] == [5]
+    assert list(iterBatches([])) == []
+
+
+def test_max_count():
+    assert [len(b) for b in iterBatches(transactions(5), max_count=2)] == [2, 2, 1]
+
+
+def test_max_bytes():
+    txs = transactions(10)
+    size = len(json.dumps(txs[0].to_json())) + 2
+    batches = list(iterBatches(txs, max_bytes=size * 3))
+    assert [len(b) for b in batches] == [3, 3, 3, 1]
+    assert [t for b in batches for t in b] == txs
+
+
+def test_oversized_transaction_gets_own_batch():
+    assert [len(b) for b in iterBatches(transactions(2), max_bytes=1)] == [1, 1]
+
+
+def test_upload_aborted_mid_stream(monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_dict({'pretix': {'server': 'https://pretix.example', 'organizer': 'org', 'key': 'key',
+                                 'batch_size': '1000'}})
+    sent = []
+    recorded = []
+
+    def post(config, payload, compress=False):
+        sent.append(len(payload['transactions']))
+        return {'id': len(sent)}
+
+    def stream():
+        yield from transactions(2500)
+        raise BankError('Page 4 could not be fetched.')
+
+    monkeypatch.setattr(pretix, 'postJob', post)
+    with pytest.raises(BankError):
+        uploadPayload(config, {'event': None, 'transactions': stream()}, lambda batch, job: recorded.append(job['id']))
+    assert sent == [1000, 1000]
+    assert sorted(recorded) == [1, 2]
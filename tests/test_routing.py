@@ -0,0 +1,73 @@
+import configparser
+
+import pytest
+
+from pretix_banktool.exceptions import ConfigError
+from pretix_banktool.routing import get_pretix_configs, get_targets
+from pretix_banktool.transaction import Transaction
+
+
+def make_config(text):
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    config.path = '/tmp/org.cfg'
+    return config
+
+
+CONFIG = '''
+[pretix]
+server = https://pretix.example
+key = shared
+
+[target:festival]
+organizer = festival
+reference = ^FEST
+
+[target:conference]
+organizer = conference
+key = own
+event = conf2026
+amount_min = 100
+amount_max = 500
+
+[target:members]
+organizer = members
+iban = DE02 1203 0000 0000 2020 51, de89370400440532013000
+'''
+
+
+def test_target_configs():
+    festival, conference, members = get_targets(make_config(CONFIG))
+    assert festival.name == 'festival'
+    assert festival.event is None
+    assert festival.config['pretix']['key'] == 'shared'
+    assert festival.config['pretix']['organizer'] == 'festival'
+    assert 'reference' not in festival.config['pretix']
+    assert festival.config.path == '/tmp/org.festival.cfg'
+    assert conference.event == 'conf2026'
+    assert conference.config['pretix']['key'] == 'own'
+    assert not any(s.startswith('target:') for s in conference.config.sections())
+
+
+def test_matches():
+    festival, conference, members = get_targets(make_config(CONFIG))
+    assert festival.matches(Transaction('10', 'FEST-123', 'Jane - DE00', '2026-01-01'))
+    assert not festival.matches(Transaction('10', 'Order FEST-123', 'Jane - DE00', '2026-01-01'))
+    assert conference.matches(Transaction('100', '', '', '2026-01-01'))
+    assert not conference.matches(Transaction('99.99', '', '', '2026-01-01'))
+    assert not conference.matches(Transaction('500.01', '', '', '2026-01-01'))
+    assert members.matches(Transaction('1', '', 'Jane-Marie Doe - DE02120300000000202051', '2026-01-01'))
+    assert members.matches(Transaction('1', '', ' - DE89370400440532013000', '2026-01-01'))
+    assert not members.matches(Transaction('1', '', 'Jane - DE00', '2026-01-01'))
+
+
+def test_invalid_rules():
+    with pytest.raises(ConfigError):
+        get_targets(make_config('[target:a]\nreference = (\n'))
+    with pytest.raises(ConfigError):
+        get_targets(make_config('[target:a]\namount_min = lots\n'))
+
+
+def test_pretix_configs_without_targets():
+    config = make_config('[pretix]\nserver = https://pretix.example\n')
+    assert get_pretix_configs(config) == [config]
@@ -0,0 +1,113 @@
+from decimal import Decimal
+
+from pretix_banktool.statements import detect_format, iter_camt, iter_statement_file
+
+MT940 = '''\
+:20:STARTUMS
+:25:10000000/1234567890
+:28C:0
+:60F:C260101EUR1000,00
+:61:2601020102CR12,50NTRFNONREF
+:86:166?00GUTSCHRIFT?20Order ABC?32Jane Doe
+:62F:C260102EUR1012,50
+-
+:20:STARTUMS
+:25:10000000/1234567890
+:28C:0
+:60F:C260102EUR1012,50
+:61:2601030103DR2,00NTRFNONREF
+:86:805?00ENTGELT?20Bank fee
+:62F:C260103EUR1010,50
+-
+'''
+
+CAMT = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+<BkToCstmrStmt><Stmt>
+  <Ntry>
+    <Amt Ccy="EUR">12.50</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts>BOOK</Sts>
+    <BookgDt><Dt>2026-01-02</Dt></BookgDt>
+    <AddtlNtryInf>GUTSCHRIFT</AddtlNtryInf>
+    <NtryDtls><TxDtls>
+      <Refs><AcctSvcrRef>B1</AcctSvcrRef><EndToEndId>NOTPROVIDED</EndToEndId></Refs>
+      <RltdPties><Dbtr><Nm>Jane Doe</Nm></Dbtr><DbtrAcct><Id><IBAN>DE02120300000000202051</IBAN></Id></DbtrAcct></RltdPties>
+      <RmtInf><Ustrd>Order</Ustrd><Ustrd>ABC</Ustrd></RmtInf>
+    </TxDtls></NtryDtls>
+  </Ntry>
+  <Ntry>
+    <Amt Ccy="EUR">2.00</Amt><CdtDbtInd>DBIT</CdtDbtInd><Sts>BOOK</Sts>
+    <BookgDt><DtTm>2026-01-03T10:00:00</DtTm></BookgDt>
+    <NtryDtls><TxDtls>
+      <Refs><EndToEndId>E2E</EndToEndId></Refs>
+      <RltdPties><Cdtr><Nm>Bank</Nm></Cdtr></RltdPties>
+    </TxDtls></NtryDtls>
+  </Ntry>
+  <Ntry>
+    <Amt Ccy="EUR">5.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts>PDNG</Sts>
+    <BookgDt><Dt>2026-01-04</Dt></BookgDt>
+  </Ntry>
+  <Ntry>
+    <CdtDbtInd>CRDT</CdtDbtInd><Sts>BOOK</Sts>
+    <BookgDt><Dt>2026-01-05</Dt></BookgDt>
+  </Ntry>
+  <Ntry>
+    <Amt Ccy="EUR">7.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts>BOOK</Sts>
+  </Ntry>
+  <Ntry>
+    <Amt Ccy="EUR">30.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts>BOOK</Sts>
+    <BookgDt><Dt>2026-01-06</Dt></BookgDt>
+    <NtryDtls>
+      <TxDtls><Amt Ccy="EUR">10.00</Amt><RmtInf><Ustrd>First</Ustrd></RmtInf></TxDtls>
+      <TxDtls><Amt Ccy="EUR">20.00</Amt><RmtInf><Ustrd>Second</Ustrd></RmtInf></TxDtls>
+    </NtryDtls>
+  </Ntry>
+</Stmt></BkToCstmrStmt>
+</Document>
+'''
+
+
+def write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path)
+
+
+def test_detect_format(tmp_path):
+    assert detect_format(write(tmp_path, 'a.sta', MT940)) == 'mt940'
+    assert detect_format(write(tmp_path, 'a.xml', '﻿\n' + CAMT)) == 'camt'
+
+
+def test_mt940(tmp_path):
+    txs = list(iter_statement_file(write(tmp_path, 'a.sta', MT940)))
+    assert [(t.amount, t.date) for t in txs] == [('12.50', '2026-01-02'), ('-2.00', '2026-01-03')]
+    assert 'Order ABC' in txs[0].reference
+
+
+def test_camt(tmp_path, capsys):
+    path = write(tmp_path, 'a.xml', CAMT)
+    entries = list(iter_camt(path))
+    assert [(e['amount'], e['date']) for e in entries] == [
+        (Decimal('12.50'), '2026-01-02'),
+        (Decimal('-2.00'), '2026-01-03'),
+        (Decimal('10.00'), '2026-01-06'),
+        (Decimal('20.00'), '2026-01-06'),
+    ]
+    assert entries[0]['purpose'] == 'Order ABC'
+    assert entries[0]['applicant_name'] == 'Jane Doe'
+    assert entries[0]['applicant_iban'] == 'DE02120300000000202051'
+    assert entries[0]['end_to_end_reference'] == ''
+    assert entries[1]['applicant_name'] == 'Bank'
+    assert entries[1]['end_to_end_reference'] == 'E2E'
+
+    out = capsys.readouterr().out
+    assert 'Skipping entry 4 with no valid amount' in out
+    assert 'Skipping entry 5 with no booking date' in out
+
+
+def test_camt_transactions(tmp_path):
+    txs = list(iter_statement_file(write(tmp_path, 'a.xml', CAMT), bank_ids=True))
+    assert txs[0].payer == 'Jane Doe - DE02120300000000202051'
+    assert txs[0].reference == 'GUTSCHRIFT Order ABC B1'
+    assert txs[0].external_id == 'B1'
+    assert txs[1].reference == ' EREF: E2E'
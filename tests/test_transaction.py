@@ -0,0 +1,43 @@
+from datetime import date
+from decimal import Decimal
+
+from pretix_banktool.transaction import Transaction
+
+
+def test_from_parts():
+    t = Transaction.from_parts(Decimal('12.50'), 'Order ABC', 'Jane Doe', 'DE02120300000000202051', date(2026, 1, 2))
+    assert t.amount == '12.50'
+    assert t.payer == 'Jane Doe - DE02120300000000202051'
+    assert t.date == '2026-01-02'
+    assert t.external_id is None
+
+
+def test_from_statement():
+    data = {
+        'amount': Decimal('-3.00'),
+        'date': date(2026, 1, 2),
+        'posting_text': 'SEPA',
+        'purpose': 'Order ABC',
+        'bank_reference': 'B1',
+        'applicant_name': 'Jane',
+        'applicant_iban': 'DE00',
+        'end_to_end_reference': 'E2E',
+    }
+    t = Transaction.from_statement(data)
+    assert t.reference == 'SEPA Order ABC B1 EREF: E2E'
+    assert t.payer == 'Jane - DE00'
+    assert t.external_id is None
+    assert Transaction.from_statement(data, bank_ids=True).external_id == 'B1'
+
+
+def test_json_roundtrip():
+    t = Transaction('1.00', 'Order', 'Jane - DE00', '2026-01-02', 'X1')
+    assert Transaction.from_json(t.to_json()) == t
+    assert 'external_id' not in Transaction('1.00', 'Order', 'Jane', '2026-01-02').to_json()
+
+
+def test_key():
+    a = Transaction('1.00', 'Order', 'Jane', '2026-01-02')
+    assert a.key() == Transaction('1.00', 'Order', 'Jane', '2026-01-02').key()
+    assert a.key() != Transaction('1.01', 'Order', 'Jane', '2026-01-02').key()
+    assert a.key() != Transaction('1.00', 'Order', 'Jane', '2026-01-02', 'X1').key()
@@ -0,0 +1,89 @@
+import pytest
+import requests
+
+from pretix_banktool import transport
+from pretix_banktool.transport import Session, TokenBucket, retry_after
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = b''
+        self.request = requests.Request()
+        self.request.body = None
+
+
+@pytest.fixture
+def server(monkeypatch):
+    answers = []
+    calls = []
+
+    def request(self, method, url, **kwargs):
+        calls.append(method)
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(requests.Session, 'request', request)
+    monkeypatch.setattr(transport.time, 'sleep', lambda s: None)
+    return answers, calls
+
+
+def test_retries_get(server):
+    answers, calls = server
+    answers.extend([Response(502), requests.ConnectionError(), Response(200)])
+    assert Session(retries=5).request('GET', 'https://pretix.example/').status_code == 200
+    assert len(calls) == 3
+
+
+def test_gives_up_after_retries(server):
+    answers, calls = server
+    answers.extend([Response(503)] * 3)
+    assert Session(retries=2).request('GET', 'https://pretix.example/').status_code == 503
+    assert len(calls) == 3
+
+
+def test_post_only_retried_when_safe(server):
+    answers, calls = server
+    answers.extend([Response(502)])
+    assert Session().request('POST', 'https://pretix.example/').status_code == 502
+
+    answers.extend([Response(429), Response(201)])
+    assert Session().request('POST', 'https://pretix.example/').status_code == 201
+
+    answers.extend([requests.ReadTimeout()])
+    with pytest.raises(requests.ReadTimeout):
+        Session().request('POST', 'https://pretix.example/')
+
+
+def test_idempotent_post(server):
+    answers, calls = server
+    answers.extend([Response(502), requests.ReadTimeout(), Response(201)])
+    assert Session().request('POST', 'https://pretix.example/', idempotent=True).status_code == 201
+    assert calls == ['POST'] * 3
+
+
+def test_retry_after():
+    assert retry_after(Response(429)) is None
+    assert retry_after(Response(429, {'Retry-After': '7'})) == 7
+    assert retry_after(Response(429, {'Retry-After': '-1'})) == 0
+    assert retry_after(Response(429, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})) == 0
+    assert retry_after(Response(429, {'Retry-After': 'soon'})) is None
+
+
+def test_token_bucket(monkeypatch):
+    now = [0.0]
+    slept = []
+
+    def sleep(s):
+        slept.append(s)
+        now[0] += s
+
+    monkeypatch.setattr(transport.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(transport.time, 'sleep', sleep)
+    bucket = TokenBucket(rate=2, burst=2)
+    for _ in range(4):
+        bucket.take()
+    assert slept == [0.5, 0.5]
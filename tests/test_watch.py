@@ -0,0 +1,54 @@
+import configparser
+import threading
+
+from pretix_banktool import sync, watch
+from pretix_banktool.transaction import Transaction
+from pretix_banktool.watch import WatchedAccount
+
+
+def make_account(tmp_path, name):
+    config = configparser.ConfigParser()
+    config.read_dict({'banktool': {'type': 'fints'}, 'pretix': {'server': 'https://pretix.example'}})
+    config.path = str(tmp_path / ('%s.cfg' % name))
+    return WatchedAccount(config.path, config, interval=0.01)
+
+
+def test_ledger_across_pool_threads(tmp_path, monkeypatch):
+    accounts = [make_account(tmp_path, 'org%d' % i) for i in range(3)]
+    syncs = {a.config.path: 0 for a in accounts}
+    threads = {a.config.path: set() for a in accounts}
+    uploaded = {a.config.path: [] for a in accounts}
+    lock = threading.Lock()
+
+    def fetch_payload(config, backend, **kwargs):
+        with lock:
+            if min(syncs.values()) >= 4:
+                raise KeyboardInterrupt()
+            syncs[config.path] += 1
+            threads[config.path].add(threading.get_ident())
+            n = syncs[config.path]
+        # Every sync sees all earlier transactions again and one new one
+        return {'transactions': (Transaction('1.00', 'Order %d' % i, 'Jane - DE00', '2026-01-01') for i in range(n))}
+
+    def upload(config, payload, on_success=None):
+        batch = list(payload['transactions'])
+        if not batch:
+            return []
+        job = {'id': len(uploaded[config.path]) + 1}
+        uploaded[config.path] += batch
+        on_success(batch, job)
+        return [job]
+
+    monkeypatch.setattr(watch, 'get_backend', lambda config: object())
+    monkeypatch.setattr(watch, 'fetch_payload', fetch_payload)
+    monkeypatch.setattr(sync, 'pretix_upload', upload)
+
+    try:
+        watch.watch(accounts, jitter=0, jobs=2)
+    except KeyboardInterrupt:
+        pass
+
+    assert any(len(t) > 1 for t in threads.values())
+    for a in accounts:
+        assert a.failures == 0
+        assert [t.reference for t in uploaded[a.config.path]] == ['Order %d' % i for i in range(syncs[a.config.path])]